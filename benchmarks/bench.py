@@ -0,0 +1,234 @@
+"""Benchmark suite for pytest-austin.
+
+The plugin is fed with synthetic Austin samples, so neither the Austin binary
+nor any tracing permissions are required. Every phase is timed over a number
+of repeats, and its peak memory usage is measured with tracemalloc on an
+additional run, so that tracing does not affect the timings. The results can
+be saved to a JSON file, and later runs can be compared against it to guard
+against performance regressions.
+
+    python benchmarks/bench.py --samples 100000 --save baseline.json
+    python benchmarks/bench.py --samples 100000 --compare baseline.json
+"""
+from argparse import ArgumentParser
+from io import BytesIO, StringIO
+import json
+import sys
+from time import perf_counter
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from generator import generate, tests
+import pytest
+from pytest_austin import PyTestAustin
+
+
+Results = Dict[str, Dict[str, Any]]
+
+MODES = {"time": None, "memory": "-m", "all": "-f"}
+
+# The markers of every test, with and without function patterns.
+MARKERS = [
+    pytest.mark.total_time("50%"),
+    pytest.mark.total_time("20%", function="function_1", module="module_1.py"),
+    pytest.mark.total_time("10%", function="function_1*", module="pkg/*"),
+    pytest.mark.self_time("10%", function="function_2", module="module_2.py"),
+    pytest.mark.total_memory("1 MB"),
+]
+
+
+def _timed(phase: Callable[["Session"], Any], session: "Session") -> float:
+    start = perf_counter()
+    phase(session)
+    return perf_counter() - start
+
+
+def _traced(phase: Callable[["Session"], Any], session: "Session") -> int:
+    tracemalloc.start()
+    try:
+        phase(session)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class Session:
+    """A benchmarked pytest-austin session."""
+
+    def __init__(self, args: Any, samples: List[Tuple[Optional[Tuple], str]]) -> None:
+        self.args = args
+        self.samples = samples
+        self.tests = tests(args.tests)
+        self.austin = PyTestAustin()
+        # The synthetic samples are collected from process 1
+        self.austin.pid = 1
+        self.austin.mode = MODES[args.mode]
+        self.austin.spill = args.spill
+
+    def ingest(self) -> None:
+        """Feed the samples to the plugin, as Austin would."""
+        austin = self.austin
+        austin.start(attach=False)
+
+        current = None
+        for test, sample in self.samples:
+            if test != current:
+                if test is None:
+                    austin.test_finished()
+                else:
+                    austin.test_started(*test)
+                current = test
+            austin.on_sample_received(sample)
+        austin.test_finished()
+
+        austin._finish()
+
+    def register(self) -> None:
+        """Register the markers of every test."""
+        for function, module in self.tests:
+            self.austin.register_test(
+                function,
+                module,
+                [marker.mark for marker in MARKERS[: self.args.markers]],
+            )
+
+    def index(self) -> None:
+        """Index the samples of every test."""
+        for function, module in self.tests:
+            self.austin._find_test(function, module)
+
+    def check(self) -> None:
+        """Run the marker checks on the indexed tests."""
+        self.austin.report.clear()
+        self.austin.check_tests()
+
+    def dump(self, fmt: str) -> None:
+        """Dump the collected samples in the given format."""
+        self.austin.formats = [fmt]
+        self.austin.dump(BytesIO() if fmt == "pprof" else StringIO())
+
+
+def run(args: Any) -> Results:
+    """Run the benchmarks and collect their results."""
+    samples = list(
+        generate(
+            args.samples,
+            args.depth,
+            args.tests,
+            MODES[args.mode],
+            stacks=args.stacks,
+            seed=args.seed,
+        )
+    )
+    nsamples, ntests = len(samples), args.tests
+
+    # The phases, in order, with the number of items they process
+    phases: List[Tuple[str, Callable[[Session], Any], int, str]] = [
+        ("ingestion", Session.ingest, nsamples, "samples"),
+        ("index", Session.index, ntests, "tests"),
+        ("checks", Session.check, ntests * args.markers, "checks"),
+    ] + [
+        (f"{fmt} dump", lambda s, fmt=fmt: s.dump(fmt), nsamples, "samples")
+        for fmt in ("austin", "pprof", "speedscope")
+    ]
+
+    times: Dict[str, List[float]] = {name: [] for name, *_ in phases}
+    for _ in range(args.repeat):
+        session = Session(args, samples)
+        for name, phase, *_ in phases:
+            if name == "index":
+                session.register()
+            times[name].append(_timed(phase, session))
+
+    peaks: Dict[str, int] = {}
+    session = Session(args, samples)
+    for name, phase, *_ in phases:
+        if name == "index":
+            session.register()
+        peaks[name] = _traced(phase, session)
+
+    return {
+        name: {
+            "time": min(times[name]),
+            "throughput": n / min(times[name]),
+            "units": f"{units}/s",
+            "peak memory": peaks[name],
+        }
+        for name, _, n, units in phases
+    }
+
+
+def report(results: Results, baseline: Optional[Results] = None) -> None:
+    """Print the results, compared with the baseline, if any."""
+    for name, result in results.items():
+        line = (
+            f"{name:<16}: {result['time'] * 1e3:10.1f} ms "
+            f"{result['throughput']:12.0f} {result['units']:<10} "
+            f"{result['peak memory'] / (1 << 20):8.1f} MB"
+        )
+        if baseline is not None and name in baseline:
+            change = result["throughput"] / baseline[name]["throughput"] - 1
+            line += f" ({change:+.1%})"
+        print(line)
+
+
+def regressions(results: Results, baseline: Results, tolerance: float) -> List[str]:
+    """The phases whose throughput dropped by more than the given tolerance."""
+    return [
+        name
+        for name, result in results.items()
+        if name in baseline
+        and result["throughput"] < (1 - tolerance) * baseline[name]["throughput"]
+    ]
+
+
+def main() -> None:
+    """Benchmark suite entry point."""
+    argp = ArgumentParser(description="Benchmark pytest-austin on synthetic samples")
+    argp.add_argument("--samples", type=int, default=100000)
+    argp.add_argument("--depth", type=int, default=16, help="The maximum stack depth")
+    argp.add_argument("--tests", type=int, default=20)
+    argp.add_argument(
+        "--stacks", type=int, default=500, help="The distinct stacks of each test"
+    )
+    argp.add_argument(
+        "--markers", type=int, default=len(MARKERS), help="The markers of each test"
+    )
+    argp.add_argument("--mode", choices=list(MODES), default="time")
+    argp.add_argument("--spill", action="store_true", help="Spill the samples")
+    argp.add_argument("--repeat", type=int, default=3)
+    argp.add_argument("--seed", type=int, default=0)
+    argp.add_argument("--save", metavar="FILE", help="Save the results to FILE")
+    argp.add_argument(
+        "--compare", metavar="FILE", help="Compare with the results in FILE"
+    )
+    argp.add_argument(
+        "--tolerance",
+        type=float,
+        default=10.0,
+        help="The throughput drop, in %%, that is a regression. Defaults to 10%%",
+    )
+    args = argp.parse_args()
+
+    results = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)
+
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as fout:
+            json.dump(results, fout, indent=2)
+
+    if baseline is not None:
+        slower = regressions(results, baseline, args.tolerance / 100)
+        if slower:
+            print(f"Regressions: {', '.join(slower)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Synthetic Austin output generator.
+
+The samples are generated from a random, but reproducible, call graph, so
+that the plugin can be benchmarked without the Austin binary, and without
+having to attach to any process.
+"""
+from random import Random
+from typing import Iterator, List, Optional, Tuple
+
+
+TestKey = Tuple[str, str]
+
+# The frames at the bottom of every stack, up to the test function
+PYTEST_FRAMES = [
+    "<module> (/venv/bin/pytest:8)",
+    "main (/venv/lib/python3.8/site-packages/_pytest/config/__init__.py:84)",
+    "pytest_runtest_call (/venv/lib/python3.8/site-packages/_pytest/runner.py:153)",
+    "pytest_pyfunc_call (/venv/lib/python3.8/site-packages/_pytest/python.py:182)",
+]
+
+
+def tests(n: int) -> List[TestKey]:
+    """The keys of the synthetic tests."""
+    return [(f"test_case_{i}", f"test_bench_{i % 8}.py") for i in range(n)]
+
+
+def generate(
+    samples: int,
+    depth: int = 16,
+    ntests: int = 20,
+    mode: Optional[str] = None,
+    stacks: int = 500,
+    functions: int = 200,
+    fanout: int = 4,
+    seed: int = 0,
+) -> Iterator[Tuple[Optional[TestKey], str]]:
+    """Generate the given number of samples, together with their test.
+
+    The samples are evenly spread across the tests, which run one after the
+    other, with a few samples collected in between. Every test has a pool of
+    at most ``stacks`` distinct stacks, which descend from the test function
+    along a random walk, at most ``depth`` calls long, over a call graph with
+    the given number of functions, each calling ``fanout`` other functions. A
+    few stacks of each pool are much hotter than the others, like in a real
+    profile. The metrics of the samples are in the format of the given Austin
+    mode.
+    """
+    rng = Random(seed)
+
+    modules = [f"/src/pkg/module_{i}.py" for i in range(max(functions // 10, 1))]
+    frames = [
+        f"function_{i} ({rng.choice(modules)}:{rng.randint(1, 100)})"
+        for i in range(functions)
+    ]
+    callees = [rng.sample(range(functions), fanout) for _ in range(functions)]
+
+    def walk(test: int) -> str:
+        function, module = keys[test]
+        stack = PYTEST_FRAMES + [f"{function} (/src/test/{module}:{rng.randint(1, 3)})"]
+
+        caller = test % functions
+        for _ in range(rng.randint(0, depth)):
+            caller = rng.choice(callees[caller])
+            stack.append(frames[caller])
+
+        return ";".join(stack)
+
+    def metrics() -> str:
+        time = rng.randint(50, 500)
+        if mode == "-m":
+            return str(rng.randint(-1024, 4096))
+        if mode == "-f":
+            return f"{time} {rng.randint(0, 4096)} {-rng.randint(0, 1024)}"
+        return str(time)
+
+    keys = tests(ntests)
+    pools = [[walk(test) for _ in range(stacks)] for test in range(ntests)]
+    idle = ";".join(PYTEST_FRAMES[:2])
+
+    per_test = samples // (ntests + 1)
+    for i in range(samples):
+        n, offset = divmod(i, per_test) if per_test else (ntests, i)
+        if n >= ntests or offset < per_test // 20:
+            # Samples collected while no test is running
+            yield None, f"P1;T1;{idle} {metrics()}"
+            continue
+
+        pool = pools[n]
+        stack = pool[int(len(pool) * rng.random() ** 3)]
+        yield keys[n], f"P1;T1;{stack} {metrics()}"
@@ -20,7 +20,7 @@ PYTEST_OPTIONS = [
     "--steal-mojo",
 ]
 
-LINT_LOCATIONS = ["pytest_austin", "test", "noxfile.py"]
+LINT_LOCATIONS = ["pytest_austin", "test", "benchmarks", "noxfile.py"]
 LINT_EXCLUDES = []
 
 MYPY_LOCATIONS = LINT_LOCATIONS[:1]
@@ -61,6 +61,13 @@ def lint(session):
     session.run("flake8", *LINT_LOCATIONS)  # , "--exclude", *LINT_EXCLUDES)
 
 
+@nox.session(python="3.8")
+def benchmark(session):
+    """Run the benchmark suite on synthetic samples."""
+    session.run("poetry", "install", "-vv", external=True)
+    session.run("poetry", "run", "python", "benchmarks/bench.py", *session.posargs)
+
+
 @nox.session(python="3.7")
 def coverage(session):
     """Upload coverage data."""
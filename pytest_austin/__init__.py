@@ -1,19 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta as td
-from functools import lru_cache
+import gzip
+from hashlib import sha1
+import json
+from mmap import ACCESS_READ, mmap
+from multiprocessing import get_context
 import os
-from threading import Event
-from time import time
-from typing import Any, Dict, Iterator, List, Optional, TextIO
+from queue import Queue
+import re
+from shutil import copyfileobj
+import sys
+from threading import Event, main_thread, Thread
+from time import perf_counter, time
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    IO,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
-from austin.format.pprof import PProf
+from ansimarkup import parse
+from austin import AustinTerminated
+from austin.format.pprof import Mode, PProf
 from austin.format.speedscope import Speedscope
-from austin.stats import AustinStats, Frame, FrameStats, InvalidSample, Sample
+from austin.stats import AustinStats, Frame, FrameStats, Sample
 from austin.threads import ThreadedAustin
-from psutil import Process
+from psutil import Error as ProcessError, Process
+import pytest_austin.diff as _diff
+from pytest_austin.history import History
+from pytest_austin.index import FrameIndex
+from pytest_austin.instrumentation import Instrumentation
 import pytest_austin.markers as _markers
+from pytest_austin.rss import PeakRSS
+from pytest_austin.store import SampleStore
 
 
 Microseconds = int
+TestKey = Tuple[str, str]
+
+EXTENSIONS = {"austin": "aprof", "pprof": "pprof", "speedscope": "json"}
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# The bounds of the adaptive sampling interval, in μs, and the minimum time, in
+# seconds, between two consecutive retunes.
+AUTO_INTERVAL_RANGE = (10, 100000)
+AUTO_PERIOD = 1.0
 
 
 def _find_from_hierarchy(
@@ -29,6 +66,11 @@ def _find_from_hierarchy(
             _find_from_hierarchy(collector, stats.children, function, module)
 
 
+def _thread_id(ident: int) -> str:
+    """The id of the thread with the given identifier in the Austin samples."""
+    return f"{ident:x}"
+
+
 def _parse_time(timedelta: Any, total_test_time: Microseconds) -> Microseconds:
     if isinstance(timedelta, td):
         return timedelta.total_seconds() * 1e6
@@ -43,6 +85,47 @@ def _parse_time(timedelta: Any, total_test_time: Microseconds) -> Microseconds:
     raise ValueError(f"Invalid time delta type {type(timedelta)}")
 
 
+def _open(filename: str, binary: bool = False) -> IO:
+    """Open a file for writing.
+
+    The data is compressed on the fly if the file name has the suffix of one of
+    the supported compressions.
+    """
+    mode = "wb" if binary else "wt"
+    if filename.endswith(COMPRESSIONS["gzip"]):
+        return gzip.open(filename, mode)
+    if filename.endswith(COMPRESSIONS["zstd"]):
+        import zstandard
+
+        return zstandard.open(filename, mode)
+    return open(filename, mode)
+
+
+def _test_filename(nodeid: str) -> str:
+    """Generate a unique file name, without extension, for a test node ID."""
+    slug = re.sub(r"[^\w.-]+", "_", nodeid)[:100]
+    return f"{slug}-{sha1(nodeid.encode()).hexdigest()[:8]}"
+
+
+class _Finished(str):
+    """The node ID of a finished test, as an item of the sample queue."""
+
+
+def _collapse(sample: Sample) -> str:
+    """Convert a sample back into the collapsed stack format."""
+    frames = "".join(f";{frame}" for frame in sample.frames)
+    return f"P{sample.pid};T{sample.thread}{frames} {sample.metrics}"
+
+
+# The pytest-austin instance whose checks are performed by a pool of forked
+# processes.
+_pool_austin: Optional["PyTestAustin"] = None
+
+
+def _check_test_in_pool(test: TestKey) -> List[Dict[str, Any]]:
+    return [outcome.export() for outcome in _pool_austin._check_test(*test)]
+
+
 class PyTestAustin(ThreadedAustin):
     """pytest implementation of Austin."""
 
@@ -51,28 +134,392 @@ class PyTestAustin(ThreadedAustin):
 
         self.ready = Event()
         self.stats = AustinStats()
+        self.frames: Dict[Frame, Frame] = {}
+        self.stores: Dict[Optional[TestKey], SampleStore] = {}
+        self.round_stores: Dict[TestKey, Dict[int, SampleStore]] = {}
         self.interval: str = "100"
+        self.auto = False
+        self.overhead = 0.1
         self.children = False
         self.mode: Optional[str] = None
-        self.data: List[str] = []
+        self.nsamples = 0
         self.global_stats: Optional[str] = None
-        self.austinfile = None
+        self.austinfiles: List[str] = []
         self.tests = {}
         self.report = []
+        self.trends = []
         self.report_level = "minimal"
-        self.format = "austin"
+        self.formats = ["austin"]
+        self.compression: Optional[str] = None
+        self.spill = False
+        self.jobs = 1
+        self.xdist_worker = False
+        self.baseline: Dict[str, Dict[str, Dict[str, List[int]]]] = {}
+        self.rounds: Dict[TestKey, int] = {}
+        self.marked_only = False
+        self.companion: Optional["PyTestAustin"] = None
+        self.peak_rss: Dict[TestKey, Tuple[int, int]] = {}
+        self.marked: Set[str] = set()
+        self.outdir: Optional[str] = None
+        self.test_files: Dict[str, List[str]] = {}
+        self.dump_errors: List[Tuple[str, str]] = []
+        self.difffile: Optional[str] = None
+        self.pid = os.getpid()
+        self.main_thread = _thread_id(main_thread().ident)
+        self.plugin_threads: Set[str] = set()
+        self.instrumentation = Instrumentation()
+
+        self._queue: Queue = Queue()
+        self._worker: Optional[Thread] = None
+        self._current: Tuple[Optional[TestKey], int] = (None, 0)
+        self._log: Optional[BinaryIO] = None
+        self._logname: Optional[str] = None
+        self._spans: List[Tuple[Tuple[Optional[TestKey], int], int]] = []
+        self._indices: Dict[TestKey, Optional[FrameIndex]] = {}
+        self._started: Optional[float] = None
+        self._tuned: Tuple[float, int] = (0.0, 0)
+        self._finished: List[Tuple[TestKey, str]] = []
+        self._rss_tests: Set[TestKey] = set()
+        self._rss: Optional[PeakRSS] = None
+        self._test_plugin_threads: Dict[TestKey, Set[str]] = {}
 
     def on_ready(
         self, process: Process, child_process: Process, command_line: str
     ) -> None:
         """Ready callback."""
+        # Prime the CPU usage measurement of Austin for the adaptive interval
+        process.cpu_percent()
         self.ready.set()
 
     def on_sample_received(self, sample: str) -> None:
         """Sample received callback."""
-        # We collect all the samples and only parse them at the end for
-        # performance
-        self.data.append(sample)
+        # We hand the samples over to the worker thread so that we can keep
+        # reading from Austin without waiting for them to be parsed. Each
+        # sample is attributed to the test, and the round of the test, that is
+        # running when it arrives.
+        self.nsamples += 1
+        self._queue.put((self._current, sample))
+
+    def _get_store(self, test: Optional[TestKey]) -> SampleStore:
+        try:
+            return self.stores[test]
+        except KeyError:
+            store = self.stores[test] = SampleStore(self.frames)
+            return store
+
+    def _get_stores(self, current: Tuple[Optional[TestKey], int]) -> List[SampleStore]:
+        """Get the sample stores of the given test and round.
+
+        The samples of repeated tests are also added to the store of the round
+        they were collected in.
+        """
+        test, round = current
+        if not round:
+            return [self._get_store(test)]
+
+        rounds = self.round_stores.setdefault(test, {})
+        try:
+            round_store = rounds[round]
+        except KeyError:
+            round_store = rounds[round] = SampleStore(self.frames)
+
+        return [self._get_store(test), round_store]
+
+    def _consume(self) -> None:
+        """Add the received samples to the sample stores of their test."""
+        queue, busy = self._queue, 0.0
+        while True:
+            item = queue.get()
+            if item is None:
+                self.instrumentation.add("ingestion", busy)
+                return
+
+            current, line = item
+            if line.__class__ is _Finished:
+                self._dump_test(current[0], line)
+                continue
+
+            start = perf_counter()
+            self.instrumentation.peak("queue backlog", queue.qsize())
+
+            for store in self._get_stores(current):
+                store.add(line)
+
+            busy += perf_counter() - start
+
+    def _spill(self) -> None:
+        """Write the received samples to the sample log.
+
+        We keep track of the offsets at which the running test changes, so that
+        the samples can be attributed to their tests when the log is read back.
+        """
+        queue, busy = self._queue, 0.0
+        offset = 0
+        while True:
+            item = queue.get()
+            if item is None:
+                self.instrumentation.add("ingestion", busy)
+                return
+
+            current, line = item
+            if line.__class__ is _Finished:
+                # The samples are in the log, so we dump the test when it is
+                # read back.
+                self._finished.append((current[0], line))
+                continue
+
+            start = perf_counter()
+            self.instrumentation.peak("queue backlog", queue.qsize())
+
+            if not self._spans or self._spans[-1][0] != current:
+                self._spans.append((current, offset))
+
+            data = line.encode() + b"\n"
+            self._log.write(data)
+            offset += len(data)
+
+            busy += perf_counter() - start
+
+    def _load_log(self) -> None:
+        """Read the sample log back into the sample stores.
+
+        The log is memory-mapped, so that only the pages that are being parsed
+        need to be resident.
+        """
+        self._log.close()
+        self._log = None
+
+        if not self._spans:
+            return
+
+        with open(self._logname, "rb") as fin, mmap(
+            fin.fileno(), 0, access=ACCESS_READ
+        ) as log:
+            ends = [offset for _, offset in self._spans[1:]] + [len(log)]
+            for (current, start), end in zip(self._spans, ends):
+                stores = self._get_stores(current)
+                while start < end:
+                    eol = log.find(b"\n", start, end)
+                    line = log[start:eol].decode()
+                    for store in stores:
+                        store.add(line)
+                    start = eol + 1
+
+    def _dump_log(self, stream: Optional[IO], filename: str) -> Optional[str]:
+        """Dump the sample log, which is in the austin format already."""
+        logname, self._logname = self._logname, None
+
+        if stream is not None:
+            with open(logname) as fin:
+                copyfileobj(fin, stream)
+            os.remove(logname)
+            return None
+
+        if self.compression is not None:
+            with open(logname, "rb") as fin, _open(filename, binary=True) as fout:
+                copyfileobj(fin, fout)
+            os.remove(logname)
+        else:
+            os.replace(logname, filename)
+
+        return os.path.join(os.getcwd(), filename)
+
+    def _discard_log(self) -> None:
+        if self._logname is not None:
+            os.remove(self._logname)
+            self._logname = None
+
+    def _add_plugin_thread(self, thread: Optional[Thread]) -> None:
+        """Keep track of a running thread of the plugin itself.
+
+        The samples of the plugin threads, like the one reading the output of
+        Austin, or the one processing the samples, would otherwise be taken for
+        work done by other threads on behalf of the test.
+        """
+        if thread is not None and thread.ident is not None:
+            self.plugin_threads.add(_thread_id(thread.ident))
+
+    def _discard_plugin_thread(self, thread: Optional[Thread]) -> None:
+        """Stop tracking a thread of the plugin, as its id can now be reused."""
+        if thread is not None and thread.ident is not None:
+            self.plugin_threads.discard(_thread_id(thread.ident))
+
+    def _finish(self) -> None:
+        """Wait for the worker thread to process all the pending samples."""
+        if self.companion is not None:
+            self.companion._finish()
+
+        if self._worker is None:
+            return
+
+        if self._started is not None:
+            self.instrumentation.add("sampling", perf_counter() - self._started)
+            self._started = None
+
+        with self.instrumentation.phase("drain"):
+            self._queue.put(None)
+            self._worker.join()
+            self._discard_plugin_thread(self._worker)
+            self._worker = None
+
+        if self._log is not None:
+            with self.instrumentation.phase("log load"):
+                self._load_log()
+
+            for test, nodeid in self._finished:
+                self._dump_test(test, nodeid)
+            self._finished.clear()
+
+        self.instrumentation.count("samples", self.nsamples)
+        self.instrumentation.count(
+            "distinct stacks", sum(len(store.stacks) for store in self.stores.values())
+        )
+        self.instrumentation.count("interned frames", len(self.frames))
+
+    def samples(self) -> Iterator[Sample]:
+        """Iterate over all the distinct samples collected by Austin."""
+        for store in self.stores.values():
+            yield from store
+
+    def export(self) -> Dict[str, Any]:
+        """Export the collected data for another pytest-austin instance.
+
+        The outcome of the checks and the distinct samples collected for each
+        test are exported using only basic types, so that they can be sent
+        across processes, e.g. from a pytest-xdist worker to the controller.
+        """
+        self._finish()
+        self._discard_log()
+
+        return {
+            "version": self.version,
+            "nsamples": self.nsamples,
+            "interval": self.interval,
+            "samples": [
+                (test, [_collapse(sample) for sample in store])
+                for test, store in self.stores.items()
+            ],
+            "report": [
+                (function, module, outcome.export())
+                for function, module, outcome in self.report
+            ],
+            "instrumentation": self.instrumentation.export(),
+            "test_files": self.test_files,
+            "dump_errors": self.dump_errors,
+        }
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """Merge the data exported by another pytest-austin instance."""
+        self._version = self._version or data["version"]
+        self.nsamples += data["nsamples"]
+        self.interval = str(max(int(self.interval), int(data["interval"])))
+
+        for test, samples in data["samples"]:
+            store = self._get_store(tuple(test) if test else None)
+            for sample in samples:
+                store.add(sample)
+
+        self.report += [
+            (function, module, _markers.CheckOutcome.load(outcome))
+            for function, module, outcome in data["report"]
+        ]
+
+        self.instrumentation.merge(data["instrumentation"])
+        self.test_files.update(data["test_files"])
+        self.dump_errors += [tuple(_) for _ in data["dump_errors"]]
+
+    def test_started(self, function: str, module: str, round: int = 0) -> None:
+        """Attribute the samples that follow to the given test.
+
+        The round is given when the test is repeated, starting from 1.
+        """
+        self._current = ((function, module), round)
+        if self.companion is not None:
+            self.companion.test_started(function, module, round)
+
+        # Repeated tests are tracked across all their rounds
+        if (function, module) in self._rss_tests and self._rss is None:
+            self._rss = PeakRSS()
+            self._rss.start()
+            self._add_plugin_thread(self._rss.get_thread())
+
+    def test_finished(self, nodeid: Optional[str] = None) -> None:
+        """Stop attributing samples to the current test.
+
+        If per-test profiles are requested, the profile of the test with the
+        given node ID is dumped as soon as all its samples are processed.
+        """
+        test, _ = self._current
+        self._current = (None, 0)
+        if test is not None:
+            self._test_plugin_threads.setdefault(test, set()).update(
+                self.plugin_threads
+            )
+        if self.companion is not None:
+            self.companion.test_finished()
+
+        if self._rss is not None:
+            self._discard_plugin_thread(self._rss.get_thread())
+            start, peak = self._rss.stop()
+            self._rss = None
+            if test is not None:
+                self.peak_rss[test] = (start, peak)
+
+        if self.outdir is not None and nodeid is not None and test is not None:
+            self._queue.put(((test, 0), _Finished(nodeid)))
+
+    def _exporter(self, fmt: str, name: str) -> Any:
+        """Create an exporter for the given format."""
+        if fmt == "austin":
+            return AustinStats()
+        if fmt == "pprof":
+            return PProf({"-m": Mode.MEMORY, "-f": Mode.FULL}.get(self.mode, Mode.TIME))
+        return Speedscope(name)
+
+    def _suffix(self) -> str:
+        """The file name suffix of the requested compression, if any."""
+        return COMPRESSIONS[self.compression] if self.compression else ""
+
+    def _dump_test(self, test: TestKey, nodeid: str) -> None:
+        """Dump the samples of a test into its own profile files."""
+        store = self.stores.get(test)
+        if not store:
+            return
+
+        with self.instrumentation.phase("test dump"):
+            exporters = {fmt: self._exporter(fmt, nodeid) for fmt in self.formats}
+            feeders = [
+                exporter.update if fmt == "austin" else exporter.add_sample
+                for fmt, exporter in exporters.items()
+            ]
+            for sample in store:
+                for feed in feeders:
+                    feed(sample)
+
+            name = _test_filename(nodeid)
+            filenames = []
+            for fmt, exporter in exporters.items():
+                filename = f"{name}.{EXTENSIONS[fmt]}{self._suffix()}"
+                # This runs on the worker thread, which must keep consuming the
+                # samples of the other tests whatever happens here.
+                try:
+                    with _open(
+                        os.path.join(self.outdir, filename), binary=fmt == "pprof"
+                    ) as fout:
+                        exporter.dump(fout)
+                except Exception as e:
+                    self.dump_errors.append((nodeid, f"{filename}: {e}"))
+                    self.instrumentation.count("test dump errors")
+                    continue
+                filenames.append(filename)
+
+            # A test that runs again, e.g. when rerun, replaces its profiles
+            self.test_files[nodeid] = filenames
+
+    def _dump_index(self) -> None:
+        """Dump the index of the per-test profile files."""
+        with open(os.path.join(self.outdir, "index.json"), "w") as fout:
+            json.dump(self.test_files, fout, indent=2)
 
     def on_terminate(self, stats: str) -> None:
         """Terminate callback."""
@@ -81,82 +528,91 @@ class PyTestAustin(ThreadedAustin):
 
     def wait_ready(self, timeout: Optional[int] = None):
         """Wait for Austin to enter the ready state."""
-        self.ready.wait(timeout)
+        with self.instrumentation.phase("wait ready"):
+            self.ready.wait(timeout)
 
-    def dump(self, stream: Optional[TextIO] = None) -> None:
+    def dump(self, stream: Optional[IO] = None) -> None:
         """Dump the collected statistics to the given IO stream.
 
-        If no stream is given, the data is dumped into a file prefixed with
-        ``.austin_`` and followed by a truncated timestamp within the pytest
-        rootdir.
+        If no stream is given, the data is dumped in every requested format
+        into a file prefixed with ``.austin_`` and followed by a truncated
+        timestamp within the pytest rootdir. All the exporters are fed with a
+        single pass over the collected samples and the files are then written
+        concurrently, compressed on the fly if a compression is requested. Only
+        a single format can be dumped into a given stream.
         """
-        if not self.data:
-            return
+        self._finish()
 
-        def _dump(filename, stream, dumper):
-            if stream is None:
-                with open(
-                    filename, "wb" if filename.endswith("pprof") else "w"
-                ) as fout:
-                    dumper.dump(fout)
-                    self.austinfile = os.path.join(os.getcwd(), filename)
-            else:
-                dumper.dump(stream)
+        if self.outdir is not None:
+            self._dump_index()
 
-        def _dump_austin():
-            _dump(f".austin_{int((time() * 1e6) % 1e14)}.aprof", stream, self.stats)
+        if not self.nsamples:
+            self._discard_log()
+            return
 
-        def _dump_pprof():
-            pprof = PProf()
+        if stream is not None and len(self.formats) > 1:
+            raise ValueError("Cannot dump multiple formats into a single stream")
 
-            for line in self.data:
-                try:
-                    pprof.add_sample(Sample.parse(line))
-                except InvalidSample:
-                    continue
+        name = f"austin_{int((time() * 1e6) % 1e14)}"
 
-            _dump(f".austin_{int((time() * 1e6) % 1e14)}.pprof", stream, pprof)
+        exporters: Dict[str, Any] = {}
+        feeders: List[Callable[[Sample], None]] = []
+        for fmt in self.formats:
+            if fmt == "austin":
+                exporters[fmt] = self.stats
+                # The spilled sample log is dumped as is
+                if self._logname is None:
+                    feeders.append(self.stats.update)
+            else:
+                exporters[fmt] = self._exporter(fmt, name)
+                feeders.append(exporters[fmt].add_sample)
 
-        def _dump_speedscope():
-            name = f"austin_{int((time() * 1e6) % 1e14)}"
-            speedscope = Speedscope(name)
+        if feeders:
+            for sample in self.samples():
+                for feed in feeders:
+                    feed(sample)
 
-            for line in self.data:
-                try:
-                    speedscope.add_sample(Sample.parse(line))
-                except InvalidSample:
-                    continue
+        def _dump(fmt: str) -> Optional[str]:
+            filename = f".{name}.{EXTENSIONS[fmt]}{self._suffix()}"
+            if fmt == "austin" and self._logname is not None:
+                return self._dump_log(stream, filename)
 
-            _dump(f".{name}.json", stream, speedscope)
+            dumper = exporters[fmt]
+            if stream is not None:
+                dumper.dump(stream)
+                return None
 
-        {"austin": _dump_austin, "pprof": _dump_pprof, "speedscope": _dump_speedscope}[
-            self.format
-        ]()
+            with _open(filename, binary=fmt == "pprof") as fout:
+                dumper.dump(fout)
+            return os.path.join(os.getcwd(), filename)
 
-    @lru_cache()
-    def _index(self) -> Dict[str, Dict[str, FrameStats]]:
-        # TODO: This code can be optimised. If we collect all the test items we
-        # can index up to the test functions. Then we keep indexing whenever
-        # we are checking eaech marked test.
+        with ThreadPoolExecutor(len(exporters)) as executor:
+            self.austinfiles += [_ for _ in executor.map(_dump, exporters) if _]
 
-        def _add_child_stats(
-            stats: FrameStats, index: Dict[str, Dict[str, FrameStats]]
-        ) -> None:
-            """Build an index of all the functions in all the modules recursively."""
-            for frame, stats in stats.children.items():
-                index.setdefault(frame.function, {}).setdefault(
-                    frame.filename, []
-                ).append(stats)
+        self._discard_log()
 
-                _add_child_stats(stats, index)
+    def dump_diff(self, filename: str) -> None:
+        """Dump the differential profile of the tests against a previous dump.
 
-        index = {}
+        The previous dump can be in either the austin or the pprof format. The
+        differential profile is written in the speedscope format, next to the
+        profile dump, and compressed if a compression is requested.
+        """
+        self._finish()
 
-        for _, process in self.stats.processes.items():
-            for _, thread in process.threads.items():
-                _add_child_stats(thread, index)
+        tests = [test for test in self.stores if test is not None]
+        before = _diff.by_test(_diff.load(filename), tests)
+        after = _diff.by_test(_diff.sample_stacks(self.samples()), tests)
 
-        return index
+        name = f"austin_diff_{int((time() * 1e6) % 1e14)}"
+        speedscope = _diff.diff(name, before, after, memory=self.mode == "-m")
+        if speedscope is None:
+            return
+
+        difffile = f".{name}.{EXTENSIONS['speedscope']}{self._suffix()}"
+        with _open(difffile) as fout:
+            speedscope.dump(fout)
+        self.difffile = os.path.join(os.getcwd(), difffile)
 
     def register_test(self, function: str, module: str, markers: Iterator) -> None:
         """Register a test with pytest-austin.
@@ -178,22 +634,143 @@ class PyTestAustin(ThreadedAustin):
             marker_args.update(marker.kwargs)
             marker_args.update({k: v for k, v in zip(arg_names, marker.args)})
 
+            # Tests are repeated as many times as requested by any of their
+            # checks.
+            rounds = marker_args.get("rounds", 1)
+            if rounds > self.rounds.get((function, module), 1):
+                self.rounds[(function, module)] = rounds
+
+            if marker.name == "cpu_time" and self.mode != "-s":
+                self._start_companion()
+
+            if marker.name == "peak_memory":
+                self._rss_tests.add((function, module))
+
             self.tests.setdefault(function, {}).setdefault(module, []).append(
-                marker_function((self, function, module), **marker_args)
+                (
+                    marker.name,
+                    rounds,
+                    marker_function((self, function, module), **marker_args),
+                )
             )
 
-    def _find_test(self, function: str, module: str) -> Optional[FrameStats]:
-        # We expect to find at most one test
-        # TODO: Match function by regex
-        module_map = self._index().get(function, None)
-        if module_map is None:
+    def _start_companion(self) -> None:
+        """Start a companion Austin instance in sleepless mode, if needed.
+
+        The companion collects the CPU time samples required by the CPU time
+        checks when the session is profiled in a different mode.
+        """
+        if self.companion is not None:
+            return
+
+        self.companion = PyTestAustin()
+        self.companion.plugin_threads = self.plugin_threads
+        self.companion.mode = "-s"
+        self.companion.interval = self.interval
+        self.companion.children = self.children
+        self.companion.start()
+        self.companion.wait_ready(1)
+
+    def cpu_index(self, function: str, module: str) -> Optional[FrameIndex]:
+        """Get the index of the CPU time samples collected for a test.
+
+        Only the last round of a repeated test is indexed.
+        """
+        if self.mode == "-s":
+            index = self._find_test(function, module)
+        elif self.companion is not None:
+            index = self.companion._find_test(function, module)
+        else:
             return None
 
-        matches = [module_map[k] for k in module_map if k.endswith(module)] + [None]
-        if len(matches) > 2:
-            RuntimeError(f"Test item {function} occurs in many matching modules.")
+        return index.last_round() if index is not None else None
+
+    def _find_test(self, function: str, module: str) -> Optional[FrameIndex]:
+        try:
+            return self._indices[(function, module)]
+        except KeyError:
+            pass
 
-        return matches[0]
+        with self.instrumentation.phase("index"):
+            index = self._index_test(function, module)
+        self._indices[(function, module)] = index
+
+        return index
+
+    def _index_test(self, function: str, module: str) -> Optional[FrameIndex]:
+        store = self.stores.get((function, module))
+        if store is None:
+            # Austin did not collect any samples while the test was running.
+            return None
+
+        index = self._index_store(store, function, module)
+        if index is not None:
+            rounds = self.round_stores.get((function, module), {})
+            index.rounds = [
+                self._index_store(rounds[round], function, module) or FrameIndex([])
+                for round in sorted(rounds)
+            ]
+
+        return index
+
+    def _index_store(
+        self, store: SampleStore, function: str, module: str
+    ) -> Optional[FrameIndex]:
+        stats = AustinStats()
+        for sample in store:
+            stats.update(sample)
+
+        # Only the samples collected while the test was running are searched
+        # for the test function frames. We strip any parameter ids from the
+        # name of parametrized test items. When the test function frames are
+        # not found, e.g. because the test function is wrapped, renamed or
+        # imported from another module, we fall back to all the frames of the
+        # main thread of the pytest process. The frames of the other threads of
+        # the pytest process are indexed separately, as these are running work
+        # on behalf of the test, e.g. in a thread pool, unless they are threads
+        # of the plugin itself. The frames of the child processes are indexed
+        # separately too, whether they were forked, and so contain the test
+        # function frames, or spawned. Both are searched for the checked
+        # functions, but neither count towards the total test time.
+        plugin_threads = self._test_plugin_threads.get((function, module), set())
+        test_stats: List[FrameStats] = []
+        main_stats: List[FrameStats] = []
+        thread_stats: List[FrameStats] = []
+        child_stats: List[FrameStats] = []
+        for process in stats.processes.values():
+            if process.pid != self.pid:
+                for thread in process.threads.values():
+                    child_stats.extend(thread.children.values())
+                continue
+
+            for thread in process.threads.values():
+                if thread.label in plugin_threads:
+                    continue
+
+                before = len(test_stats)
+                _find_from_hierarchy(
+                    test_stats, thread.children, function.partition("[")[0], module
+                )
+                if len(test_stats) > before:
+                    continue
+                if thread.label == self.main_thread:
+                    main_stats.extend(thread.children.values())
+                else:
+                    thread_stats.extend(thread.children.values())
+
+        if not test_stats:
+            test_stats = main_stats
+        else:
+            thread_stats += main_stats
+
+        if not test_stats:
+            return None
+
+        index = FrameIndex(test_stats)
+        index.threads = FrameIndex(thread_stats)
+        if child_stats:
+            index.children = FrameIndex(child_stats)
+        return index
 
     def check_tests(self) -> int:
         """Check all the registered tests against the collected statistics.
@@ -203,52 +780,319 @@ class PyTestAustin(ThreadedAustin):
         if self.is_running():
             raise RuntimeError("Austin is still running.")
 
-        if not self.data:
+        self._finish()
+
+        if not self.nsamples and not self.peak_rss:
             return 0
 
-        # Prepare stats
-        for sample in self.data:
-            try:
-                self.stats.update(Sample.parse(sample))
-            except InvalidSample:
-                pass
-
-        for function, modules in self.tests.items():
-            for module, markers in modules.items():
-                test_stats = self._find_test(function, module)
-                if test_stats is None:
-                    # The test was not found. Either there is no such test or
-                    # Austin did not collect any statistics for it.
+        tests = [
+            (function, module)
+            for function, modules in self.tests.items()
+            for module in modules
+        ]
+
+        if self.jobs > 1 and len(tests) > 1:
+            outcomes = self._check_in_pool(tests)
+        else:
+            outcomes = [
+                self._check_test(function, module) for function, module in tests
+            ]
+
+        for (function, module), test_outcomes in zip(tests, outcomes):
+            self.report += [(function, module, outcome) for outcome in test_outcomes]
+
+        return sum(1 for outcome in self.report if not outcome[2])
+
+    def _check_test(self, function: str, module: str) -> List[_markers.CheckOutcome]:
+        """Check a registered test against its collected statistics."""
+        index = self._find_test(function, module)
+        if index is not None:
+            # The checks of repeated tests are performed on the last round,
+            # unless they requested the rounds themselves, so that absolute
+            # budgets are not exceeded just because the test ran more than once.
+            last_round = index.last_round()
+            totals = self.totals(index.roots)
+            last_round_totals = self.totals(last_round.roots)
+
+        outcomes = []
+        for name, rounds, marker in self.tests[function][module]:
+            if index is None:
+                # The test was not found. Either there is no such test or
+                # Austin did not collect any statistics for it. The resident
+                # set size is tracked without Austin, so it can still be
+                # checked.
+                if name != "peak_memory":
                     continue
+                outcome = marker(None, 0, 0, 0)
+            elif rounds > 1:
+                outcome = marker(index, *totals)
+            else:
+                outcome = marker(last_round, *last_round_totals)
 
-                total_test_time = sum(fs.total.time for fs in test_stats)
-                total_test_malloc = sum(
-                    fs.total.time if self.mode == "-m" else fs.total.memory_alloc
-                    for fs in test_stats
-                )
-                total_test_dealloc = (
-                    sum(fs.total.memory_dealloc for fs in test_stats)
-                    if self.mode == "-f"
-                    else 0
+            # Markers return no outcome when their check cannot be performed
+            if outcome is not None:
+                outcomes.append(outcome)
+
+        return outcomes
+
+    def totals(self, stats: List[FrameStats]) -> Tuple[int, int, int]:
+        """Total time, memory allocations and deallocations of the frames."""
+        total_time = sum(fs.total.time for fs in stats)
+        total_malloc = sum(
+            fs.total.time if self.mode == "-m" else fs.total.memory_alloc
+            for fs in stats
+        )
+        total_dealloc = (
+            sum(fs.total.memory_dealloc for fs in stats) if self.mode == "-f" else 0
+        )
+        return total_time, total_malloc, total_dealloc
+
+    def save_baseline(self, filename: str) -> None:
+        """Save the collected statistics of each test to a baseline file.
+
+        For each test, we save the total time, memory allocations and
+        deallocations of every function that was called while the test was
+        running.
+        """
+        self._finish()
+
+        tests = {}
+        for test in self.stores:
+            if test is None:
+                continue
+
+            function, module = test
+            index = self._find_test(function, module)
+            if index is None:
+                continue
+
+            functions: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+            for frame_function, frame_module, stats in index.last_round().functions():
+                functions.setdefault(frame_function, {})[frame_module] = self.totals(
+                    stats
                 )
 
-                for marker in markers:
-                    outcome = marker(
-                        test_stats,
-                        total_test_time,
-                        total_test_malloc,
-                        total_test_dealloc,
+            tests[f"{module}::{function}"] = functions
+
+        with open(filename, "w") as fout:
+            json.dump({"mode": self.mode, "tests": tests}, fout)
+
+    def test_totals(self) -> List[Tuple[TestKey, Tuple[int, int, int]]]:
+        """The total time, memory allocations and deallocations of each test."""
+        self._finish()
+
+        totals = []
+        for test in self.stores:
+            if test is None:
+                continue
+
+            index = self._find_test(*test)
+            if index is not None:
+                totals.append((test, self.totals(index.last_round().roots)))
+
+        return totals
+
+    def hot_functions(self, function: str, module: str, n: int) -> List[str]:
+        """Report the n hottest functions of a test, by self and total time.
+
+        In memory mode, the functions are ranked by their memory allocations
+        instead.
+        """
+        self._finish()
+
+        index = self._find_test(function, module)
+        if index is None:
+            return []
+
+        formatter = (
+            _markers.CheckOutcome._format_size
+            if self.mode == "-m"
+            else _markers.CheckOutcome._format_time
+        )
+        self_times, total_times = index.hottest(n)
+
+        return [
+            parse(
+                f"  {kind:<5} <bold>{function}</bold> (<cyan>{filename}</cyan>) "
+                f"{formatter(value)}"
+            )
+            for kind, hottest in (("self", self_times), ("total", total_times))
+            for value, function, filename in hottest
+        ]
+
+    def save_history(
+        self, filename: str, window: int = 0, tolerance: float = 0.1
+    ) -> None:
+        """Append the outcome of the checks and the test totals to a history.
+
+        If a window is given, the tests whose median over the last ``window``
+        runs deviates from their history by more than the relative tolerance
+        are flagged in the trends.
+        """
+        totals = self.test_totals()
+
+        history = History(filename)
+        try:
+            history.record(self.version, self.mode, self.interval, self.report, totals)
+
+            if window:
+                self.trends = list(
+                    history.trends(
+                        [test for test, _ in totals], self.mode, window, tolerance
                     )
-                    self.report.append((function, module, outcome))
+                )
+        finally:
+            history.close()
 
-        return sum(1 for outcome in self.report if not outcome[2])
+    def load_baseline(self, filename: str) -> None:
+        """Load a baseline file saved with :func:`save_baseline`."""
+        with open(filename) as fin:
+            baseline = json.load(fin)
+
+        if baseline["mode"] != self.mode:
+            raise ValueError("the baseline was saved with a different profile mode")
+
+        self.baseline = baseline["tests"]
+
+    def _check_in_pool(self, tests: List[TestKey]) -> List[List[_markers.CheckOutcome]]:
+        """Shard the checks of the given tests across a pool of workers.
+
+        The marker checks cannot be pickled, so we rely on forked processes
+        inheriting the collected data. Forking a process with other running
+        threads, like those of pytest-xdist in its workers, is unsafe, and so
+        is forking on macOS, so we fall back to a pool of threads on any other
+        platform than Linux, and within pytest-xdist workers.
+        """
+        global _pool_austin
+
+        if sys.platform != "linux" or self.xdist_worker:
+            with ThreadPoolExecutor(self.jobs) as executor:
+                return list(executor.map(lambda test: self._check_test(*test), tests))
+
+        _pool_austin = self
+        try:
+            with get_context("fork").Pool(self.jobs) as pool:
+                outcomes = pool.map(
+                    _check_test_in_pool,
+                    tests,
+                    chunksize=max(1, len(tests) // (self.jobs * 4)),
+                )
+        finally:
+            _pool_austin = None
+
+        return [
+            [_markers.CheckOutcome.load(outcome) for outcome in test_outcomes]
+            for test_outcomes in outcomes
+        ]
+
+    def retune(self) -> None:
+        """Retune the sampling interval, if adaptive.
+
+        The interval is scaled so that the CPU usage of Austin meets the target
+        overhead. When Austin cannot keep up with the requested interval, the
+        interval observed from the sample arrival rate is scaled instead, but
+        only in the wall time modes. Austin is restarted only when the interval
+        changes by more than a factor of 2.
+        """
+        if not self.auto or not self.is_running():
+            return
+
+        now, nsamples = perf_counter(), self.nsamples
+        since, tuned_nsamples = self._tuned
+        if now - since < AUTO_PERIOD:
+            return
+
+        try:
+            usage = self.get_process().cpu_percent() / 100
+        except (AttributeError, ProcessError):
+            return
+
+        self._tuned = (now, nsamples)
+
+        current = int(self.interval)
+        interval = current
+        # In memory and CPU time mode, Austin only sends samples for the threads
+        # that allocate memory or are on CPU, so the arrival rate of the samples
+        # tells nothing about the effective interval.
+        if self.mode in (None, "-f") and nsamples > tuned_nsamples:
+            interval = max(
+                interval, int((now - since) * 1e6 / (nsamples - tuned_nsamples))
+            )
+
+        low, high = AUTO_INTERVAL_RANGE
+        interval = min(max(int(interval * usage / self.overhead), low), high)
+        if current / 2 <= interval <= current * 2:
+            return
+
+        with self.instrumentation.phase("retune"):
+            self.detach()
+            self.interval = str(interval)
+            self.attach()
+
+        self.instrumentation.count("retunes")
+
+    def attach(self) -> None:
+        """Attach Austin to the current process and wait for it to be ready."""
+        self._attach()
+        self.wait_ready(1)
+
+        if self.companion is not None:
+            self.companion.attach()
 
-    def start(self) -> None:
-        """Start Austin."""
+    def detach(self) -> None:
+        """Detach Austin from the current process, if attached."""
+        if self.companion is not None:
+            self.companion.detach()
+
+        if self.is_running():
+            self.terminate(wait=True)
+
+        if self._started is not None:
+            self.instrumentation.add("sampling", perf_counter() - self._started)
+            self._started = None
+
+        if self.get_thread() is None:
+            # Austin was never attached
+            return
+
+        try:
+            self.join()
+        except AustinTerminated:
+            pass
+        self._discard_plugin_thread(self.get_thread())
+
+    def _attach(self) -> None:
+        """Attach Austin to the current process."""
         args = ["-t", "10", "-i", self.interval, "-p", str(os.getpid())]
         if self.mode:
             args.append(self.mode)
         if self.children:
             args.append("-C")
 
+        self.ready.clear()
+        self._started = perf_counter()
+        self._tuned = (self._started, self.nsamples)
+
         super().start(args)
+        self._add_plugin_thread(self.get_thread())
+
+    def start(self, attach: bool = True) -> None:
+        """Start Austin.
+
+        If ``attach`` is false, only the sample processing is started and
+        Austin is attached later on with :func:`attach`.
+        """
+        if self.spill:
+            self._logname = os.path.join(
+                os.getcwd(), f".austin_{int((time() * 1e6) % 1e14)}.log"
+            )
+            self._log = open(self._logname, "wb", buffering=1 << 20)
+
+        self._worker = Thread(
+            target=self._spill if self.spill else self._consume, daemon=True
+        )
+        self._worker.start()
+        self._add_plugin_thread(self._worker)
+
+        if attach:
+            self._attach()
@@ -0,0 +1,175 @@
+import gzip
+import re
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from austin.format.pprof import MEMORY_TYPE
+from austin.format.pprof.profile_pb2 import Profile
+from austin.format.speedscope import Speedscope, SpeedscopeProfile, Units
+from austin.stats import Frame, Sample
+from pytest_austin.store import SampleStore
+
+
+TestKey = Tuple[str, str]
+
+# Frames are compared without their line numbers, as these change as soon as
+# any code is added or removed above them.
+Stack = Tuple[Frame, ...]
+Stacks = Dict[Stack, int]
+
+
+def _read(filename: str) -> BinaryIO:
+    """Open a file for reading, decompressing it on the fly if needed."""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    if filename.endswith(".zst"):
+        import zstandard
+
+        return zstandard.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def _stack(frames: Iterable[Frame]) -> Stack:
+    return tuple(Frame(frame.function, frame.filename) for frame in frames)
+
+
+def sample_stacks(samples: Iterable[Sample]) -> Iterator[Tuple[Stack, int]]:
+    """Convert Austin samples into frame stacks and their time."""
+    for sample in samples:
+        yield _stack(sample.frames), sample.metrics.time
+
+
+def _load_austin(stream: BinaryIO) -> Iterator[Tuple[Stack, int]]:
+    store = SampleStore()
+    for line in stream:
+        store.add(line.decode().rstrip("\n"))
+    return sample_stacks(store)
+
+
+def _load_pprof(stream: BinaryIO) -> Iterator[Tuple[Stack, int]]:
+    profile = Profile()
+    profile.ParseFromString(stream.read())
+
+    strings = profile.string_table
+    functions = {
+        function.id: Frame(strings[function.name], strings[function.filename])
+        for function in profile.function
+    }
+    # The lines of a location, like the locations of a sample, are listed from
+    # the top of the stack.
+    locations = {
+        location.id: [functions[line.function_id] for line in location.line][::-1]
+        for location in profile.location
+    }
+
+    for sample in profile.sample:
+        stack: List[Frame] = []
+        for location_id in reversed(sample.location_id):
+            stack += locations[location_id]
+        yield tuple(stack), sample.value[0]
+
+
+def _is_pprof(filename: str) -> bool:
+    return re.search(r"\.pprof(\.gz|\.zst)?$", filename) is not None
+
+
+def memory(filename: str) -> Optional[bool]:
+    """Whether a profile dumped by pytest-austin was collected in memory mode.
+
+    Only pprof dumps record the kind of their samples, so ``None`` is returned
+    for dumps in the austin format.
+    """
+    if not _is_pprof(filename):
+        return None
+
+    profile = Profile()
+    with _read(filename) as stream:
+        profile.ParseFromString(stream.read())
+
+    return profile.string_table[profile.sample_type[0].type] == MEMORY_TYPE
+
+
+def load(filename: str) -> Iterator[Tuple[Stack, int]]:
+    """Load the frame stacks from a profile dumped by pytest-austin.
+
+    Both the austin and the pprof formats are supported, optionally compressed.
+    The time of each stack is returned with it, or the memory allocations in
+    memory mode. Dumps in the austin format do not record their mode, so it is
+    up to the caller to compare them with samples collected in the same mode.
+    """
+    with _read(filename) as stream:
+        if _is_pprof(filename):
+            yield from _load_pprof(stream)
+        else:
+            yield from _load_austin(stream)
+
+
+def by_test(
+    stacks: Iterable[Tuple[Stack, int]], tests: Iterable[TestKey]
+) -> Dict[TestKey, Stacks]:
+    """Attribute the frame stacks to the given tests.
+
+    Only the part of each stack that starts with the outermost frame of a test
+    function is kept, so that stacks from different runs can be compared
+    regardless of how pytest got to run the test. Stacks without any test
+    frames are discarded.
+    """
+    modules: Dict[str, List[str]] = {}
+    for function, module in tests:
+        modules.setdefault(function.partition("[")[0], []).append(module)
+
+    attributed: Dict[TestKey, Stacks] = {}
+    for stack, value in stacks:
+        for i, frame in enumerate(stack):
+            test_modules = modules.get(frame.function)
+            if test_modules is None:
+                continue
+            module = next((_ for _ in test_modules if frame.filename.endswith(_)), None)
+            if module is None:
+                continue
+
+            test_stacks = attributed.setdefault((frame.function, module), {})
+            test_stack = stack[i:]
+            test_stacks[test_stack] = test_stacks.get(test_stack, 0) + value
+            break
+
+    return attributed
+
+
+def diff(
+    name: str,
+    before: Dict[TestKey, Stacks],
+    after: Dict[TestKey, Stacks],
+    memory: bool = False,
+) -> Optional[Speedscope]:
+    """Generate the differential profile of the tests between two runs.
+
+    Every test gets two profiles, with the frame stacks that gained, and that
+    lost, time (or memory allocations in memory mode), weighed by how much
+    they gained or lost. Tests that did not run in both runs are skipped, and
+    nothing is generated if no frame stack of any test changed.
+    """
+    speedscope = Speedscope(name)
+    metric, units = ("Memory", Units.BYTES) if memory else ("Time", Units.MICROSECONDS)
+
+    for test in sorted(before.keys() & after.keys()):
+        old, new = before[test], after[test]
+        function, module = test
+
+        gained = SpeedscopeProfile(
+            f"{metric} gained by {module}::{function}", units.value
+        )
+        lost = SpeedscopeProfile(f"{metric} lost by {module}::{function}", units.value)
+        for stack in {**old, **new}:
+            delta = new.get(stack, 0) - old.get(stack, 0)
+            if not delta:
+                continue
+
+            frames = [speedscope.get_frame(frame) for frame in stack]
+            if delta > 0:
+                gained.add_sample(frames, delta)
+            else:
+                lost.add_sample(frames, -delta)
+
+        speedscope.profiles += [_ for _ in (gained, lost) if _.samples]
+
+    return speedscope if speedscope.profiles else None
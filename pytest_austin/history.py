@@ -0,0 +1,146 @@
+import platform
+import sqlite3
+from statistics import median
+from time import time
+from typing import Iterator, List, Optional, Tuple
+
+from pytest_austin.markers import Bytes, CheckOutcome, Microseconds
+
+
+TestKey = Tuple[str, str]
+Totals = Tuple[int, int, int]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL,
+    hostname TEXT,
+    python TEXT,
+    austin TEXT,
+    mode TEXT,
+    interval TEXT
+);
+CREATE TABLE IF NOT EXISTS outcomes (
+    run INTEGER REFERENCES runs(id),
+    function TEXT,
+    module TEXT,
+    mark_function TEXT,
+    mark_module TEXT,
+    mark_line INTEGER,
+    actual REAL,
+    expected REAL,
+    units TEXT,
+    result INTEGER,
+    spread REAL
+);
+CREATE TABLE IF NOT EXISTS totals (
+    run INTEGER REFERENCES runs(id),
+    function TEXT,
+    module TEXT,
+    time INTEGER,
+    malloc INTEGER,
+    dealloc INTEGER
+);
+CREATE INDEX IF NOT EXISTS totals_by_test ON totals(module, function, run);
+"""
+
+
+class History:
+    """Local SQLite database with the performance history of the tests.
+
+    Every run appends the outcome of its checks, together with the total time,
+    memory allocations and deallocations of each test, so that the trend of
+    each test can be followed across many runs.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self._db = sqlite3.connect(filename)
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """Close the database."""
+        self._db.close()
+
+    def record(
+        self,
+        austin: Optional[str],
+        mode: Optional[str],
+        interval: str,
+        report: List[Tuple[str, str, CheckOutcome]],
+        totals: List[Tuple[TestKey, Totals]],
+    ) -> int:
+        """Record a run and return its ID."""
+        with self._db:
+            run = self._db.execute(
+                "INSERT INTO runs (timestamp, hostname, python, austin, mode, interval) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    time(),
+                    platform.node(),
+                    platform.python_version(),
+                    austin,
+                    mode,
+                    interval,
+                ),
+            ).lastrowid
+
+            self._db.executemany(
+                "INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        run,
+                        function,
+                        module,
+                        *outcome.mark,
+                        outcome.actual,
+                        outcome.expected,
+                        outcome.units.__name__,
+                        outcome.result,
+                        outcome.spread,
+                    )
+                    for function, module, outcome in report
+                ),
+            )
+
+            self._db.executemany(
+                "INSERT INTO totals VALUES (?, ?, ?, ?, ?, ?)",
+                ((run, function, module, *_) for (function, module), _ in totals),
+            )
+
+        return run
+
+    def trends(
+        self, tests: List[TestKey], mode: Optional[str], window: int, tolerance: float
+    ) -> Iterator[Tuple[str, str, CheckOutcome]]:
+        """Compare the recent performance of the given tests with their history.
+
+        The median of the last ``window`` runs of each test is compared with the
+        median of all the runs before them, in the same profile mode. Tests with
+        fewer previous runs than ``window`` are skipped. The outcome fails if the
+        recent median deviates by more than the given relative tolerance.
+        """
+        for function, module in tests:
+            # The total time holds the memory allocations in memory mode
+            values = [
+                value
+                for value, in self._db.execute(
+                    "SELECT totals.time FROM totals JOIN runs ON runs.id = totals.run "
+                    "WHERE function = ? AND module = ? AND mode IS ? "
+                    "ORDER BY run DESC",
+                    (function, module, mode),
+                )
+            ]
+            if len(values) < 2 * window:
+                continue
+
+            recent, history = median(values[:window]), median(values[window:])
+            if not history:
+                continue
+
+            yield function, module, CheckOutcome(
+                (function, module, 0),
+                recent,
+                history,
+                Bytes if mode == "-m" else Microseconds,
+                abs(recent - history) <= tolerance * history,
+            )
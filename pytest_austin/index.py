@@ -0,0 +1,244 @@
+from fnmatch import translate
+from functools import lru_cache
+from heapq import heappush, heapreplace
+import re
+from typing import Callable, Dict, Iterator, List, Optional, Pattern, Tuple, Union
+
+from austin.stats import FrameStats
+
+
+Selector = Union[str, Pattern]
+PatternType = type(re.compile(""))
+FrameKey = Tuple[Selector, Selector, int, bool]
+HotFunction = Tuple[int, str, str]
+
+
+def is_pattern(selector: Selector) -> bool:
+    """Whether the selector is a glob or a regular expression."""
+    return isinstance(selector, PatternType) or any(c in selector for c in "*?[")
+
+
+@lru_cache(maxsize=None)
+def matcher(selector: Selector, module: bool = False) -> Callable[[str], bool]:
+    """Compile a function or module selector into a matcher.
+
+    Function selectors match the whole function name, whereas module selectors
+    match the end of the file name, like plain module names do. Regular
+    expressions are used as they are for functions, and are searched anywhere
+    within the file name for modules.
+    """
+    if isinstance(selector, PatternType):
+        return selector.search if module else selector.fullmatch
+
+    if is_pattern(selector):
+        return re.compile(translate(f"*{selector}" if module else selector)).fullmatch
+
+    if module:
+        return lambda filename: filename.endswith(selector)
+
+    return selector.__eq__
+
+
+class FrameIndex:
+    """Inverted index of the frames collected for a test.
+
+    The index is built with a single traversal of the call trees rooted at the
+    given frame statistics and maps every function and module to the frame
+    statistics of each of its occurrences. Every occurrence also records the
+    modules of the ancestor frames for the same function, so that only the
+    outermost frames are matched, as recursive calls would otherwise be
+    counted more than once.
+    """
+
+    def __init__(self, roots: List[FrameStats]) -> None:
+        self.roots = roots
+
+        # The indices of each round, for tests that are repeated
+        self.rounds: List["FrameIndex"] = []
+
+        # The index of the other threads that ran while the test was running
+        self.threads: Optional["FrameIndex"] = None
+        self._with_threads: Dict[Selector, "FrameIndex"] = {}
+
+        # The index of the child processes that ran while the test was running
+        self.children: Optional["FrameIndex"] = None
+
+        self._index: Dict[str, Dict[str, List[Tuple[FrameStats, Tuple[str, ...]]]]] = {}
+        self._cache: Dict[FrameKey, List[FrameStats]] = {}
+
+        # The function frames on the current path, by function name
+        path: Dict[str, Tuple[str, ...]] = {}
+        stack = [(stats, False) for stats in reversed(roots)]
+        while stack:
+            stats, leaving = stack.pop()
+            function, filename = stats.label.function, stats.label.filename
+
+            if leaving:
+                ancestors = path[function][:-1]
+                if ancestors:
+                    path[function] = ancestors
+                else:
+                    del path[function]
+                continue
+
+            ancestors = path.get(function, ())
+            self._index.setdefault(function, {}).setdefault(filename, []).append(
+                (stats, ancestors)
+            )
+            path[function] = ancestors + (filename,)
+
+            stack.append((stats, True))
+            stack.extend((child, False) for child in stats.children.values())
+
+    def find(
+        self, function: str, module: str, line: int = 0, nested: bool = False
+    ) -> List[FrameStats]:
+        """Find the outermost frames for the given function and module.
+
+        The module matches any file name that ends with it. If a line number
+        is given, only the frames on that line are returned. If nested is set,
+        the frames nested within other frames of the same function, e.g. in
+        recursive calls, are returned too.
+
+        The function and the module can also be glob patterns, or compiled
+        regular expressions, in which case the outermost frames of all the
+        matching functions are returned.
+
+        The frames of the child processes, if any, are searched too.
+        """
+        key = (function, module, line, nested)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        if is_pattern(function) or is_pattern(module):
+            matches = self._find_pattern(function, module, line, nested)
+        else:
+            matches = [
+                stats
+                for filename, occurrences in self._index.get(function, {}).items()
+                if filename.endswith(module)
+                for stats, ancestors in occurrences
+                if (
+                    nested
+                    or not any(ancestor.endswith(module) for ancestor in ancestors)
+                )
+                and (not line or stats.label.line == line)
+            ]
+
+        if self.children is not None:
+            matches = matches + self.children.find(function, module, line, nested)
+
+        self._cache[key] = matches
+
+        return matches
+
+    def with_threads(self, threads: Union[bool, Selector, None]) -> "FrameIndex":
+        """Get an index that includes the frames of the other threads too.
+
+        If threads is ``True``, all the frames of the other threads are
+        included. If it is a function selector, only the outermost frames of the
+        matching functions within the other threads are included.
+        """
+        if not threads or self.threads is None:
+            return self
+
+        try:
+            return self._with_threads[threads]
+        except KeyError:
+            pass
+
+        extra = (
+            self.threads.roots if threads is True else self.threads.find(threads, "")
+        )
+        index = self._with_threads[threads] = FrameIndex(self.roots + extra)
+        index.children = self.children
+        index.rounds = [_.with_threads(threads) for _ in self.rounds]
+
+        return index
+
+    def last_round(self) -> "FrameIndex":
+        """Get the index of the last round of a repeated test.
+
+        The index itself is returned if the test is not repeated.
+        """
+        return self.rounds[-1] if self.rounds else self
+
+    def _find_pattern(
+        self, function: Selector, module: Selector, line: int, nested: bool
+    ) -> List[FrameStats]:
+        match_function, match_module = matcher(function), matcher(module, True)
+
+        # Only the functions that match are looked for in the call trees
+        functions = {
+            name
+            for name, modules in self._index.items()
+            if match_function(name) and any(match_module(_) for _ in modules)
+        }
+        if not functions:
+            return []
+
+        matches = []
+        stack = list(reversed(self.roots))
+        while stack:
+            stats = stack.pop()
+            label = stats.label
+            if label.function in functions and match_module(label.filename):
+                if not line or label.line == line:
+                    matches.append(stats)
+                if not nested:
+                    continue
+            stack.extend(reversed(list(stats.children.values())))
+
+        return matches
+
+    def functions(self) -> Iterator[Tuple[str, str, List[FrameStats]]]:
+        """Iterate over all the indexed functions and modules.
+
+        For every function and module, the outermost frames are returned. The
+        functions of the child processes, if any, follow.
+        """
+        for function, modules in self._index.items():
+            for filename, occurrences in modules.items():
+                yield function, filename, [
+                    stats
+                    for stats, ancestors in occurrences
+                    if filename not in ancestors
+                ]
+
+        if self.children is not None:
+            yield from self.children.functions()
+
+    def hottest(self, n: int) -> Tuple[List[HotFunction], List[HotFunction]]:
+        """Find the n hottest functions, by self and by total time.
+
+        Every function is returned with the module it belongs to, after its
+        time. The total time of a function only counts its outermost frames,
+        whereas its self time counts all of them. Functions that spent no time
+        in their own code are left out of the self times. Only the n hottest
+        functions are kept in a heap, so that the functions need not be sorted.
+        """
+        self_times: List[HotFunction] = []
+        total_times: List[HotFunction] = []
+        if n <= 0:
+            return self_times, total_times
+
+        def keep(heap: List[HotFunction], hot: HotFunction) -> None:
+            if len(heap) < n:
+                heappush(heap, hot)
+            elif hot > heap[0]:
+                heapreplace(heap, hot)
+
+        for function, modules in self._index.items():
+            for filename, occurrences in modules.items():
+                self_time = total_time = 0
+                for stats, ancestors in occurrences:
+                    self_time += stats.own.time
+                    if filename not in ancestors:
+                        total_time += stats.total.time
+                if self_time:
+                    keep(self_times, (self_time, function, filename))
+                keep(total_times, (total_time, function, filename))
+
+        return sorted(self_times, reverse=True), sorted(total_times, reverse=True)
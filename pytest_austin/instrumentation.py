@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Dict, Iterator, List
+
+
+class Instrumentation:
+    """Self-instrumentation of pytest-austin.
+
+    Keeps track of the time spent by the plugin in each of its phases, together
+    with some counters (e.g. the number of samples) and the peak values of some
+    gauges (e.g. the backlog of samples waiting to be processed).
+    """
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.peaks: Dict[str, int] = {}
+
+    def add(self, phase: str, duration: float) -> None:
+        """Add the given duration, in seconds, to a phase."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """Time the wrapped code as part of the given phase."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, perf_counter() - start)
+
+    def count(self, counter: str, value: int = 1) -> None:
+        """Increase a counter by the given value."""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def peak(self, gauge: str, value: int) -> None:
+        """Record the value of a gauge if it is a new peak."""
+        if value > self.peaks.get(gauge, 0):
+            self.peaks[gauge] = value
+
+    def export(self) -> Dict[str, Any]:
+        """Export the collected data using only basic types."""
+        return {"phases": self.phases, "counters": self.counters, "peaks": self.peaks}
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """Merge the data exported by another instance."""
+        for phase, duration in data["phases"].items():
+            self.add(phase, duration)
+        for counter, value in data["counters"].items():
+            self.count(counter, value)
+        for gauge, value in data["peaks"].items():
+            self.peak(gauge, value)
+
+    def report(self) -> List[str]:
+        """Generate a human readable report of the collected data."""
+        lines = [
+            f"{phase:<24}: {duration * 1e3:.1f} ms"
+            for phase, duration in self.phases.items()
+        ]
+
+        # The rate at which Austin sends samples, and the rate at which we can
+        # process them.
+        samples = self.counters.get("samples", 0)
+        for phase in ("sampling", "ingestion"):
+            duration = self.phases.get(phase)
+            if samples and duration:
+                lines.append(
+                    f"{phase + ' rate':<24}: {samples / duration:.0f} samples/s"
+                )
+
+        lines += [f"{counter:<24}: {value}" for counter, value in self.counters.items()]
+        lines += [
+            f"{'peak ' + gauge:<24}: {value}" for gauge, value in self.peaks.items()
+        ]
+
+        return lines
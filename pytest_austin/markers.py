@@ -1,9 +1,12 @@
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import timedelta as td
-from typing import Any, Dict, List, NewType, Tuple, Type
+from statistics import mean, median, pstdev
+from typing import Any, Dict, List, NewType, Optional, Tuple, Type
 
 from ansimarkup import parse
-from austin.stats import Frame, FrameStats
+from austin.stats import FrameStats, Metrics
+from psutil import virtual_memory
+from pytest_austin.index import is_pattern, matcher
 
 
 Microseconds = NewType("Microseconds", int)
@@ -19,6 +22,11 @@ class CheckOutcome:
     expected: float
     units: Type
     result: bool
+    spread: Optional[float] = None
+
+    def __post_init__(self):
+        """Report pattern selectors by their pattern."""
+        self.mark = tuple(getattr(_, "pattern", _) for _ in self.mark)
 
     @staticmethod
     def _format_size(size):
@@ -38,6 +46,22 @@ class CheckOutcome:
             return f"{time / 1e3:.1f} ms"
         return f"{time:.1f} μs"
 
+    def export(self) -> Dict[str, Any]:
+        """Export the outcome using only basic types."""
+        outcome = asdict(self)
+        outcome["units"] = self.units.__name__
+        return outcome
+
+    @staticmethod
+    def load(outcome: Dict[str, Any]) -> "CheckOutcome":
+        """Load an outcome exported with :func:`export`."""
+        outcome = dict(outcome)
+        outcome["mark"] = tuple(outcome["mark"])
+        outcome["units"] = {"Microseconds": Microseconds, "Bytes": Bytes}[
+            outcome["units"]
+        ]
+        return CheckOutcome(**outcome)
+
     def __bool__(self):
         """Return the outcome result."""
         return self.result
@@ -45,7 +69,8 @@ class CheckOutcome:
     def __str__(self):
         """Give a human readable description of the outcome."""
         delta = self.actual - self.expected
-        perc = delta * 100 / self.expected
+        # A zero expected value, e.g. a 0% budget, has no relative delta
+        perc = f"{delta * 100 / self.expected:.1f}% " if self.expected else ""
 
         function, module, line = self.mark
 
@@ -59,26 +84,14 @@ class CheckOutcome:
         how_much = (
             f"<red>+{formatter(delta)}</red>"
             if delta > 0
-            else f"<green>-{formatter(-delta)}</green>"
+            else f"<green>-{formatter(abs(delta))}</green>"
         )
+        spread = f" ± {formatter(self.spread)}" if self.spread is not None else ""
         return parse(
-            f"{what} <bold>{how_much}</bold> <fg 128,128,128>({perc:.1f}% of {formatter(self.expected)})</fg 128,128,128>"
+            f"{what} <bold>{how_much}</bold>{spread} <fg 128,128,128>({perc}of {formatter(self.expected)})</fg 128,128,128>"
         )
 
 
-def _find_from_hierarchy(
-    collector: List[FrameStats],
-    stats_list: Dict[Frame, FrameStats],
-    function: str,
-    module: str,
-) -> None:
-    for label, stats in stats_list.items():
-        if label.function == function and label.filename.endswith(module):
-            collector.append(stats)
-        else:
-            _find_from_hierarchy(collector, stats.children, function, module)
-
-
 def _parse_time(timedelta: Any, total_test_time: Microseconds) -> Microseconds:
     try:
         if isinstance(timedelta, td):
@@ -118,26 +131,89 @@ def _parse_memory(size: Any, total_memory: Bytes) -> Bytes:
     raise ValueError(f"Invalid memory size format or type {type(size)}")
 
 
-def total_time(mark, time, function=None, module=None, line=0):
+def _frame_function(test_function: str) -> str:
+    """Get the function name of a test item, without any parameter ids."""
+    return test_function.partition("[")[0]
+
+
+def _self_metrics(frames: List[FrameStats]) -> Metrics:
+    """Get the self metrics of the frames, i.e. without those of their children."""
+    return Metrics(
+        sum(fs.own.time for fs in frames),
+        sum(fs.own.memory_alloc for fs in frames),
+        sum(fs.own.memory_dealloc for fs in frames),
+    )
+
+
+def _frames(index, function, module, line, whole_test):
+    """Find the frames to check in the index.
+
+    The whole test includes the frames of the other threads in the index, if
+    any.
+    """
+    if whole_test and not line:
+        return index.roots
+    return index.find(function, module, line)
+
+
+def total_time(
+    mark,
+    time,
+    function=None,
+    module=None,
+    line=0,
+    rounds=1,
+    statistic="median",
+    threads=None,
+):
     """
     Check that the marked line doesn't take more than the given time delta to
-    execute. If no line is given, then the whole function is considered.
+    execute. If no line is given, then the whole function is considered. If
+    rounds is greater than 1, the test is run that many times and the check is
+    performed on the median, or the mean, of the times of each round. Set
+    threads to ``True`` to include the work done by other threads while the
+    test runs, or to a function to only include the calls to it from other
+    threads.
     """
     _, test_function, test_module = mark
-    function = function or test_function
+    whole_test = bool(threads) and function is None
+    function = function or _frame_function(test_function)
     module = module or test_module
 
-    def _(test_stats, total_test_time, total_test_malloc, total_test_dealloc):
-        # find by function and module from index
-        function_stats = []
-        _find_from_hierarchy(
-            function_stats, {s.label: s for s in test_stats}, function, module,
-        )
-
-        if line:
-            function_stats = [fs for fs in function_stats if fs.label.line == line]
+    try:
+        summarize = {"median": median, "mean": mean}[statistic]
+    except KeyError:
+        raise ValueError(f"Invalid statistic {statistic}") from None
+
+    def _(index, total_test_time, total_test_malloc, total_test_dealloc):
+        spread = None
+
+        if threads:
+            index = index.with_threads(threads)
+            total_test_time = sum(fs.total.time for fs in index.roots)
+
+        if rounds > 1 and index.rounds:
+            # find by function and module from the index of each round
+            round_times = [
+                sum(
+                    fs.total.time
+                    for fs in _frames(round_index, function, module, line, whole_test)
+                )
+                for round_index in index.rounds
+            ]
+            function_total_time = summarize(round_times)
+            total_test_time = summarize(
+                [
+                    sum(fs.total.time for fs in round_index.roots)
+                    for round_index in index.rounds
+                ]
+            )
+            spread = pstdev(round_times)
+        else:
+            # find by function and module from index
+            function_stats = _frames(index, function, module, line, whole_test)
 
-        function_total_time = sum(fs.total.time for fs in function_stats)
+            function_total_time = sum(fs.total.time for fs in function_stats)
 
         expected_time = _parse_time(time, total_test_time)
         outcome = function_total_time <= expected_time
@@ -148,37 +224,131 @@ def total_time(mark, time, function=None, module=None, line=0):
             expected=expected_time,
             units=Microseconds,
             result=outcome,
+            spread=spread,
+        )
+
+    return _
+
+
+def self_time(mark, time, function=None, module=None, line=0, threads=None):
+    """
+    Check that the marked line doesn't take more than the given time delta to
+    execute its own code, that is excluding the time spent in the functions
+    that it calls. If no line is given, then the whole function is considered.
+    The threads argument is the same as for the ``total_time`` marker.
+    """
+    _, test_function, test_module = mark
+    function = function or _frame_function(test_function)
+    module = module or test_module
+
+    def _(index, total_test_time, total_test_malloc, total_test_dealloc):
+        if threads:
+            index = index.with_threads(threads)
+            total_test_time = sum(fs.total.time for fs in index.roots)
+
+        # Self times do not overlap, so we include all the recursive calls
+        function_self_time = _self_metrics(
+            index.find(function, module, line, nested=True)
+        ).time
+
+        expected_time = _parse_time(time, total_test_time)
+
+        return CheckOutcome(
+            mark=(function, module, line),
+            actual=function_self_time,
+            expected=expected_time,
+            units=Microseconds,
+            result=function_self_time <= expected_time,
+        )
+
+    return _
+
+
+def cpu_time(mark, time, function=None, module=None, line=0, threads=None):
+    """
+    Check that the marked line doesn't take more than the given CPU time to
+    execute. If no line is given, then the whole function is considered. The
+    CPU time is measured by sampling with Austin in sleepless mode, that is by
+    discarding the idle samples. The threads argument is the same as for the
+    ``total_time`` marker.
+    """
+    pytest_austin, test_function, test_module = mark
+    whole_test = bool(threads) and function is None
+    function = function or _frame_function(test_function)
+    module = module or test_module
+
+    def _(index, total_test_time, total_test_malloc, total_test_dealloc):
+        # Tests that never run on the CPU have no CPU time samples at all
+        cpu_index = pytest_austin.cpu_index(test_function, test_module)
+        if cpu_index is None:
+            function_cpu_time = total_test_cpu_time = 0
+        else:
+            cpu_index = cpu_index.with_threads(threads)
+            function_cpu_time = sum(
+                fs.total.time
+                for fs in _frames(cpu_index, function, module, line, whole_test)
+            )
+            total_test_cpu_time = sum(fs.total.time for fs in cpu_index.roots)
+
+        expected_time = _parse_time(time, total_test_cpu_time)
+
+        return CheckOutcome(
+            mark=(function, module, line),
+            actual=function_cpu_time,
+            expected=expected_time,
+            units=Microseconds,
+            result=function_cpu_time <= expected_time,
         )
 
     return _
 
 
-def total_memory(mark, size, function=None, module=None, line=0, net=False):
+def total_memory(
+    mark,
+    size,
+    function=None,
+    module=None,
+    line=0,
+    net=False,
+    exclusive=False,
+    threads=None,
+):
     """
     Check that the marked line doesn't allocate more than the given memory to
     execute. If no line is given, then the whole function is considered. If net
     is set to ``True`` it will consider the net memory usage, that is the sum
-    between memory allocations and deallocations.
+    between memory allocations and deallocations. If exclusive is set to
+    ``True``, only the memory allocated by the code of the function itself is
+    considered, excluding the functions that it calls. The threads argument is
+    the same as for the ``total_time`` marker.
     """
     pytest_austin, test_function, test_module = mark
-    function = function or test_function
+    whole_test = bool(threads) and function is None
+    function = function or _frame_function(test_function)
     module = module or test_module
 
-    def _(test_stats, total_test_time, total_test_malloc, total_test_dealloc):
-        # find by function and module from index
-        function_stats = []
-        _find_from_hierarchy(
-            function_stats, {s.label: s for s in test_stats}, function, module,
-        )
+    def _(index, total_test_time, total_test_malloc, total_test_dealloc):
+        if threads:
+            index = index.with_threads(threads)
+            _, total_test_malloc, total_test_dealloc = pytest_austin.totals(index.roots)
+
+        if exclusive:
+            metrics = _self_metrics(index.find(function, module, line, nested=True))
+            function_total_alloc = (
+                metrics.time if pytest_austin.mode == "-m" else metrics.memory_alloc
+            )
+            function_total_dealloc = metrics.memory_dealloc
+        else:
+            # find by function and module from index
+            function_stats = _frames(index, function, module, line, whole_test)
 
-        if line:
-            function_stats = [fs for fs in function_stats if fs.label.line == line]
-
-        function_total_alloc = sum(
-            fs.total.time if pytest_austin.mode == "-m" else fs.total.memory_alloc
-            for fs in function_stats
-        )
-        function_total_dealloc = sum(fs.total.memory_dealloc for fs in function_stats)
+            function_total_alloc = sum(
+                fs.total.time if pytest_austin.mode == "-m" else fs.total.memory_alloc
+                for fs in function_stats
+            )
+            function_total_dealloc = sum(
+                fs.total.memory_dealloc for fs in function_stats
+            )
 
         total_memory = (
             total_test_malloc if not net else total_test_malloc + total_test_dealloc
@@ -200,3 +370,99 @@ def total_memory(mark, size, function=None, module=None, line=0, net=False):
         )
 
     return _
+
+
+def peak_memory(mark, size, growth=False):
+    """
+    Check that the resident set size of the process doesn't exceed the given
+    size while the marked test runs. Percentages are relative to the total
+    physical memory. If growth is set to ``True``, the increase of the resident
+    set size over its value at the start of the test is checked instead.
+    """
+    pytest_austin, test_function, test_module = mark
+
+    def _(index, total_test_time, total_test_malloc, total_test_dealloc):
+        try:
+            start, peak = pytest_austin.peak_rss[(test_function, test_module)]
+        except KeyError:
+            # The test did not run
+            return None
+
+        actual = peak - start if growth else peak
+        expected = _parse_memory(size, virtual_memory().total)
+
+        return CheckOutcome(
+            mark=(_frame_function(test_function), test_module, 0),
+            actual=actual,
+            expected=expected,
+            units=Bytes,
+            result=actual <= expected,
+        )
+
+    return _
+
+
+def no_regression(mark, tolerance="10%", function=None, module=None, memory=False):
+    """
+    Check that the marked test, or the given function, doesn't take more time
+    to execute than in the baseline given with the ``--austin-compare`` option,
+    within the given tolerance. If memory is set to ``True``, memory
+    allocations are checked instead.
+    """
+    pytest_austin, test_function, test_module = mark
+    baseline = pytest_austin.baseline.get(f"{test_module}::{test_function}", {})
+    function = function or _frame_function(test_function)
+    module = module or test_module
+
+    match_function, match_module = matcher(function), matcher(module, True)
+
+    def _(index, total_test_time, total_test_malloc, total_test_dealloc):
+        baseline_stats = [
+            metrics
+            for frame_function, modules in baseline.items()
+            if match_function(frame_function)
+            for filename, metrics in modules.items()
+            if match_module(filename)
+        ]
+        if not baseline_stats:
+            # Nothing to compare against
+            return None
+
+        if is_pattern(function) or is_pattern(module):
+            # The baseline has the totals of each function, so we compare them
+            # with the totals of each of the matching functions.
+            actual_stats = [
+                fs
+                for frame_function, filename, frames in index.functions()
+                if match_function(frame_function) and match_module(filename)
+                for fs in frames
+            ]
+        else:
+            actual_stats = index.find(function, module)
+
+        actual_time, actual_malloc, _ = pytest_austin.totals(actual_stats)
+
+        baseline_value = sum(metrics[1 if memory else 0] for metrics in baseline_stats)
+        if baseline_value <= 0:
+            # There is no meaningful baseline to compare against, e.g. memory
+            # allocations from a baseline saved in time mode.
+            return None
+
+        if memory:
+            actual = actual_malloc
+            expected = baseline_value + _parse_memory(tolerance, baseline_value)
+            units = Bytes
+        else:
+            actual = actual_time
+            expected = baseline_value + _parse_time(tolerance, baseline_value)
+            units = Microseconds
+
+        return CheckOutcome(
+            mark=(function, module, 0),
+            actual=actual,
+            expected=expected,
+            units=units,
+            result=actual <= expected,
+        )
+
+    return _
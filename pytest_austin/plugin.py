@@ -1,9 +1,19 @@
-from austin import AustinTerminated
-from pytest import Function, hookimpl, Module
+from importlib.util import find_spec
+import json
+import os
+from typing import Callable, Iterator, Optional, Tuple, Union
+
+from pytest import Function, hookimpl, Module, UsageError
 from pytest_austin import PyTestAustin
+import pytest_austin.diff as diff
 import pytest_austin.markers as markers
 
 
+def _sampling_interval(value: str) -> Union[int, str]:
+    """Parse the sampling interval option, which can also be 'auto'."""
+    return value if value == "auto" else int(value)
+
+
 def pytest_addoption(parser, pluginmanager) -> None:
     """Add Austin command line options to pytest."""
     group = parser.getgroup("austin", "statistical profiling with Austin")
@@ -17,16 +27,26 @@ def pytest_addoption(parser, pluginmanager) -> None:
 
     group.addoption(
         "--profile-mode",
-        choices=["time", "memory", "all"],
+        choices=["time", "cpu", "memory", "all"],
         default="time",
-        help="The profile mode. Defaults to 'time'",
+        help="The profile mode. The 'cpu' mode measures CPU time rather than wall "
+        "time. Defaults to 'time'",
     )
 
     group.addoption(
         "--sampling-interval",
-        type=int,
+        type=_sampling_interval,
         default=100,
-        help="Austin sampling interval in μs. Defaults to 100 μs",
+        help="Austin sampling interval in μs, or 'auto' to adapt it to the "
+        "target overhead while the tests run. Defaults to 100 μs",
+    )
+
+    group.addoption(
+        "--austin-target-overhead",
+        type=float,
+        default=10.0,
+        help="The share of a CPU, in %%, that Austin should use when the sampling "
+        "interval is 'auto'. Defaults to 10%%",
     )
 
     group.addoption(
@@ -38,9 +58,112 @@ def pytest_addoption(parser, pluginmanager) -> None:
 
     group.addoption(
         "--profile-format",
+        action="append",
         choices=["austin", "speedscope", "pprof"],
-        default="austin",
-        help="Output profiler data file format. Defaults to 'austin'",
+        default=None,
+        help="Output profiler data file format. Can be given multiple times to "
+        "dump the data in many formats. Defaults to 'austin'",
+    )
+
+    group.addoption(
+        "--austin-marked-only",
+        action="store_true",
+        default=False,
+        help="Only profile the tests that are marked with Austin checks",
+    )
+
+    group.addoption(
+        "--austin-compress",
+        choices=["gzip", "zstd"],
+        default=None,
+        help="Compress the profile files on the fly. The zstd compression requires "
+        "the zstandard package",
+    )
+
+    group.addoption(
+        "--austin-per-test",
+        metavar="DIR",
+        default=None,
+        help="Write the profile of each test to its own file within the given "
+        "directory, as soon as the test finishes",
+    )
+
+    group.addoption(
+        "--austin-spill",
+        action="store_true",
+        default=False,
+        help="Stream the collected samples to a log file on disk rather than "
+        "keeping them in memory while the tests run",
+    )
+
+    group.addoption(
+        "--austin-jobs",
+        type=int,
+        default=1,
+        help="The number of parallel jobs used to perform the checks at the end "
+        "of the session. Defaults to 1",
+    )
+
+    group.addoption(
+        "--austin-save-baseline",
+        metavar="FILE",
+        default=None,
+        help="Save the statistics collected for each test to the given baseline "
+        "file, for later comparisons",
+    )
+
+    group.addoption(
+        "--austin-compare",
+        metavar="FILE",
+        default=None,
+        help="The baseline file used by the no_regression checks",
+    )
+
+    group.addoption(
+        "--austin-diff",
+        metavar="FILE",
+        default=None,
+        help="Write a differential speedscope profile of the tests against a "
+        "previous profile dump, in either the austin or the pprof format",
+    )
+
+    group.addoption(
+        "--austin-history",
+        metavar="DB",
+        default=None,
+        help="Append the outcome of the checks and the totals of each test to the "
+        "given SQLite database",
+    )
+
+    group.addoption(
+        "--austin-trend",
+        metavar="WINDOW",
+        type=int,
+        default=0,
+        help="Flag the tests whose median over the last WINDOW runs deviates from "
+        "their history. Requires --austin-history",
+    )
+
+    group.addoption(
+        "--austin-trend-tolerance",
+        type=float,
+        default=10.0,
+        help="The deviation, in %%, from the history that is flagged by "
+        "--austin-trend. Defaults to 10%%",
+    )
+
+    group.addoption(
+        "--austin-overhead",
+        action="store_true",
+        default=False,
+        help="Report the overhead of the plugin itself",
+    )
+
+    group.addoption(
+        "--austin-overhead-json",
+        metavar="FILE",
+        default=None,
+        help="Save the overhead of the plugin itself to the given JSON file",
     )
 
     group.addoption(
@@ -51,10 +174,18 @@ def pytest_addoption(parser, pluginmanager) -> None:
         "checks are reported.",
     )
 
+    group.addoption(
+        "--austin-top",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Report the N hottest functions, by self and total time, of the tests "
+        "with failed checks, or of all the checked tests with the full report",
+    )
 
-def pytest_configure(config) -> None:
-    """Configure pytest-austin."""
-    # Register all markers
+
+def _markers() -> Iterator[Callable]:
+    """Iterate over the markers provided by pytest-austin."""
     for _ in dir(markers):
         _ = getattr(markers, _)
 
@@ -69,6 +200,14 @@ def pytest_configure(config) -> None:
             # We cannot get the argument names, so not a marker
             continue
 
+        yield _
+
+
+def pytest_configure(config) -> None:
+    """Configure pytest-austin."""
+    # Register all markers
+    for _ in _markers():
+        args = _.__code__.co_varnames
         config.addinivalue_line(
             "markers", f"{_.__name__}({', '.join(args[1:])}):{_.__doc__}"
         )
@@ -81,40 +220,177 @@ def pytest_configure(config) -> None:
     pytest_austin = PyTestAustin()
 
     if config.option.profile_mode != "time":
-        pytest_austin.mode = {"memory": "-m", "all": "-f"}[config.option.profile_mode]
-
-    pytest_austin.interval = str(config.option.sampling_interval)
+        pytest_austin.mode = {"cpu": "-s", "memory": "-m", "all": "-f"}[
+            config.option.profile_mode
+        ]
+
+    if config.option.sampling_interval == "auto":
+        pytest_austin.auto = True
+        pytest_austin.overhead = config.option.austin_target_overhead / 100
+    else:
+        pytest_austin.interval = str(config.option.sampling_interval)
     pytest_austin.children = config.option.minime
     pytest_austin.report_level = config.option.austin_report
-    pytest_austin.format = config.option.profile_format
+    pytest_austin.spill = config.option.austin_spill
+    pytest_austin.jobs = config.option.austin_jobs
+    pytest_austin.xdist_worker = _is_xdist_worker(config)
+    pytest_austin.marked_only = config.option.austin_marked_only
+
+    if config.option.austin_per_test:
+        pytest_austin.outdir = os.path.abspath(config.option.austin_per_test)
+        os.makedirs(pytest_austin.outdir, exist_ok=True)
+
+    if config.option.austin_trend and not config.option.austin_history:
+        raise UsageError("--austin-trend requires --austin-history")
+
+    if config.option.austin_compare:
+        try:
+            pytest_austin.load_baseline(config.option.austin_compare)
+        except (OSError, ValueError, KeyError) as e:
+            raise UsageError(
+                f"Cannot load Austin baseline {config.option.austin_compare}: {e}"
+            ) from e
+    pytest_austin.formats = list(
+        dict.fromkeys(config.option.profile_format or ["austin"])
+    )
+
+    if config.option.austin_compress == "zstd" and find_spec("zstandard") is None:
+        raise UsageError("The zstd compression requires the zstandard package")
+    if config.option.austin_diff:
+        if not os.path.isfile(config.option.austin_diff):
+            raise UsageError(f"Cannot find profile dump {config.option.austin_diff}")
+        memory = diff.memory(config.option.austin_diff)
+        if memory is not None and memory != (pytest_austin.mode == "-m"):
+            raise UsageError(
+                f"The profile dump {config.option.austin_diff} was collected "
+                "in a different profile mode"
+            )
+    pytest_austin.compression = config.option.austin_compress
 
     config.pluginmanager.register(pytest_austin, "austin")
 
 
+def _is_xdist_controller(config) -> bool:
+    """Whether we are the controller of a pytest-xdist session."""
+    return config.pluginmanager.hasplugin("dsession")
+
+
+def _is_xdist_worker(config) -> bool:
+    """Whether we are a pytest-xdist worker."""
+    return hasattr(config, "workerinput")
+
+
 def pytest_sessionstart(session) -> None:
     """Start Austin if we have mojo."""
     pytest_austin = session.config.pluginmanager.getplugin("austin")
     if not pytest_austin:
         return
 
+    if _is_xdist_controller(session.config):
+        # The controller does not run any tests. Each worker profiles itself.
+        return
+
+    if pytest_austin.marked_only:
+        # Austin is attached only when the marked tests run
+        pytest_austin.start(attach=False)
+        return
+
     pytest_austin.start()
     pytest_austin.wait_ready(1)
 
 
+def pytest_collection_modifyitems(session, config, items) -> None:
+    """Find the tests that are marked with Austin checks."""
+    pytest_austin = config.pluginmanager.getplugin("austin")
+    if not pytest_austin or not pytest_austin.marked_only:
+        return
+
+    names = {marker.__name__ for marker in _markers()}
+    pytest_austin.marked = {
+        item.nodeid
+        for item in items
+        if any(marker.name in names for marker in item.iter_markers())
+    }
+
+
+def _test_key(item) -> Optional[Tuple[str, str]]:
+    """Get the function and module names of a test item, if supported."""
+    if isinstance(item, Function) and isinstance(item.parent, Module):
+        return item.name, item.parent.name
+    return None
+
+
 def pytest_runtest_setup(item) -> None:
     """Register tests and checks with pytest-austin."""
     pytest_austin = item.config.pluginmanager.getplugin("austin")
     if not pytest_austin:
         return
 
+    if pytest_austin.marked_only and item.nodeid in pytest_austin.marked:
+        if not pytest_austin.is_running():
+            pytest_austin.attach()
+
     if pytest_austin.is_running():
-        if isinstance(item, Function) and isinstance(item.parent, Module):
-            function, module = item.name, item.parent.name
+        pytest_austin.retune()
+
+        key = _test_key(item)
+        if key is not None:
+            function, module = key
             pytest_austin.register_test(
                 function, module, item.iter_markers(),
             )
 
 
+def pytest_runtest_teardown(item, nextitem) -> None:
+    """Detach Austin after the last of consecutive marked tests, if required."""
+    pytest_austin = item.config.pluginmanager.getplugin("austin")
+    if not pytest_austin or not pytest_austin.marked_only:
+        return
+
+    if nextitem is None or nextitem.nodeid not in pytest_austin.marked:
+        pytest_austin.detach()
+
+
+@hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    """Attribute the samples collected while the test runs to the test item."""
+    pytest_austin = item.config.pluginmanager.getplugin("austin")
+    key = _test_key(item) if pytest_austin else None
+    if key is None:
+        yield
+        return
+
+    # The samples of repeated tests are attributed to their first round until
+    # the next one starts in pytest_pyfunc_call.
+    pytest_austin.test_started(*key, 1 if pytest_austin.rounds.get(key, 1) > 1 else 0)
+    yield
+    pytest_austin.test_finished(item.nodeid)
+
+
+@hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem) -> None:
+    """Run the extra rounds requested by the checks, if any.
+
+    The extra rounds run within the capture and logging hook wrappers, like the
+    last round, which is the actual test call made by the default
+    implementation. The function-scoped fixtures are shared by all the rounds.
+    """
+    pytest_austin = pyfuncitem.config.pluginmanager.getplugin("austin")
+    key = _test_key(pyfuncitem) if pytest_austin else None
+    rounds = pytest_austin.rounds.get(key, 1) if key is not None else 1
+    if rounds == 1:
+        return None
+
+    funcargs = pyfuncitem.funcargs
+    testargs = {arg: funcargs[arg] for arg in pyfuncitem._fixtureinfo.argnames}
+    for round in range(1, rounds):
+        pytest_austin.test_started(*key, round)
+        pyfuncitem.obj(**testargs)
+
+    pytest_austin.test_started(*key, rounds)
+    return None
+
+
 @hookimpl(hookwrapper=True)
 def pytest_runtestloop(session):
     """Run all checks at the end and set the exit status."""
@@ -125,17 +401,58 @@ def pytest_runtestloop(session):
     if not pytest_austin:
         return
 
-    if pytest_austin.is_running():
-        pytest_austin.terminate(wait=True)
+    instrumentation = pytest_austin.instrumentation
+
+    if _is_xdist_controller(session.config):
+        # All the workers are down by now and we have merged their data.
+        session.testsfailed += sum(
+            1 for *_, outcome in pytest_austin.report if not outcome
+        )
+    else:
+        pytest_austin.detach()
+
+        with instrumentation.phase("checks"):
+            session.testsfailed += pytest_austin.check_tests()
+
+        if _is_xdist_worker(session.config):
+            # Send the outcome of the checks and the samples to the controller
+            session.config.workeroutput["austin"] = pytest_austin.export()
+            return
+
+    if session.config.option.austin_save_baseline:
+        with instrumentation.phase("baseline"):
+            pytest_austin.save_baseline(session.config.option.austin_save_baseline)
+
+    if session.config.option.austin_history:
+        with instrumentation.phase("history"):
+            pytest_austin.save_history(
+                session.config.option.austin_history,
+                session.config.option.austin_trend,
+                session.config.option.austin_trend_tolerance / 100,
+            )
+
+    with instrumentation.phase("dump"):
+        pytest_austin.dump()
+
+    if session.config.option.austin_diff:
+        with instrumentation.phase("diff"):
+            pytest_austin.dump_diff(session.config.option.austin_diff)
 
-    try:
-        pytest_austin.join()
-    except AustinTerminated:
-        pass
+    if session.config.option.austin_overhead_json:
+        with open(session.config.option.austin_overhead_json, "w") as fout:
+            json.dump(instrumentation.export(), fout, indent=2)
 
-    session.testsfailed += pytest_austin.check_tests()
 
-    pytest_austin.dump()
+@hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error) -> None:
+    """Merge the data collected by a pytest-xdist worker."""
+    pytest_austin = node.config.pluginmanager.getplugin("austin")
+    if not pytest_austin:
+        return
+
+    data = getattr(node, "workeroutput", {}).get("austin")
+    if data is not None:
+        pytest_austin.merge(data)
 
 
 def pytest_terminal_summary(terminalreporter, exitstatus, config) -> None:
@@ -146,20 +463,49 @@ def pytest_terminal_summary(terminalreporter, exitstatus, config) -> None:
 
     terminalreporter.write_sep("=", "Austin report")
     terminalreporter.write_line(f"austin {pytest_austin.version}")
-    if not pytest_austin.data:
+
+    if config.option.austin_overhead:
+        for line in pytest_austin.instrumentation.report():
+            terminalreporter.write_line(line)
+        terminalreporter.write_line("")
+
+    if not pytest_austin.nsamples:
         terminalreporter.write_line("No data collected.")
         return
 
-    if pytest_austin.austinfile is not None:
-        terminalreporter.write_line(
-            f"Collected stats written on {pytest_austin.austinfile}\n"
-        )
+    if pytest_austin.auto:
+        line = f"Adaptive sampling interval: {pytest_austin.interval} μs"
+        sampling = pytest_austin.instrumentation.phases.get("sampling")
+        if sampling:
+            line += f" ({pytest_austin.nsamples / sampling:.0f} samples/s)"
+        terminalreporter.write_line(line + "\n")
+
+    if pytest_austin.austinfiles:
+        for austinfile in pytest_austin.austinfiles:
+            terminalreporter.write_line(f"Collected stats written on {austinfile}")
+        terminalreporter.write_line("")
+
+        if pytest_austin.difffile is not None:
+            terminalreporter.write_line(
+                f"Differential profile written on {pytest_austin.difffile}"
+            )
+            terminalreporter.write_line("")
+
+        if pytest_austin.outdir is not None:
+            terminalreporter.write_line(
+                f"Per-test profiles written in {pytest_austin.outdir}"
+            )
+            for nodeid, error in pytest_austin.dump_errors:
+                terminalreporter.write_line(
+                    f"Cannot write the profile of {nodeid}: {error}", yellow=True
+                )
+            terminalreporter.write_line("")
 
         if pytest_austin.global_stats:
             terminalreporter.write_line(pytest_austin.global_stats + "\n")
         else:
             terminalreporter.write_line(
-                f"Austin collected a total of {len(pytest_austin.data)} samples\n"
+                f"Austin collected a total of {pytest_austin.nsamples} samples\n"
             )
 
     # Report failed Austin conditions
@@ -174,8 +520,40 @@ def pytest_terminal_summary(terminalreporter, exitstatus, config) -> None:
         for function, module, outcome in checks:
             terminalreporter.write_line(f"{module}::{function} {outcome}")
 
+        # Report the hottest functions of the tests with reported checks
+        top = config.option.austin_top
+        if top > 0:
+            tests = dict.fromkeys((function, module) for function, module, _ in checks)
+            for function, module in tests:
+                lines = pytest_austin.hot_functions(function, module, top)
+                if not lines:
+                    continue
+
+                terminalreporter.write_line("")
+                terminalreporter.write_line(f"{module}::{function} hottest functions")
+                for line in lines:
+                    terminalreporter.write_line(line)
+
         terminalreporter.write_line("")
         terminalreporter.write_sep(
             "=", f"{n} check{'s' if n > 1 else ''} failed", red=True, bold=True,
         )
         terminalreporter.write_line("")
+
+    # Report the tests that deviate from their history
+    trends = pytest_austin.trends
+    deviations = [trend for trend in trends if not trend[2]]
+    if pytest_austin.report_level == "minimal":
+        trends = deviations
+
+    if trends:
+        terminalreporter.write_sep("-", "Austin trends")
+        for function, module, outcome in trends:
+            terminalreporter.write_line(f"{module}::{function} {outcome}")
+
+        n = len(deviations)
+        terminalreporter.write_line("")
+        terminalreporter.write_sep(
+            "=", f"{n} test{'s' if n != 1 else ''} deviating from history", yellow=True
+        )
+        terminalreporter.write_line("")
@@ -0,0 +1,81 @@
+from threading import Event, Thread
+from typing import Optional, Tuple
+
+from psutil import Process
+
+
+def _reset_hwm() -> bool:
+    """Reset the resident set size high-water mark kept by the Linux kernel."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _read_hwm() -> Optional[int]:
+    """Read the resident set size high-water mark kept by the Linux kernel."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) << 10
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class PeakRSS:
+    """Resident set size high-water mark tracker.
+
+    Where the kernel keeps track of the high-water mark, and allows resetting
+    it, this is used. Otherwise, the resident set size of the current process
+    is polled by a background thread at the given interval, in seconds.
+    """
+
+    def __init__(self, interval: float = 1e-3) -> None:
+        self.interval = interval
+        self.start_rss = 0
+        self.peak = 0
+
+        self._process = Process()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self._hwm = False
+
+    def start(self) -> None:
+        """Start tracking the high-water mark."""
+        self._hwm = _reset_hwm()
+        self.start_rss = self.peak = self._process.memory_info().rss
+        if self._hwm:
+            # The kernel keeps the exact peak, so we need not compete with the
+            # test for the GIL.
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def get_thread(self) -> Optional[Thread]:
+        """Get the polling thread, if the resident set size is being polled."""
+        return self._thread
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = self._process.memory_info().rss
+            if rss > self.peak:
+                self.peak = rss
+
+    def stop(self) -> Tuple[int, int]:
+        """Stop tracking and return the starting and the peak resident set size."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+        self.peak = max(self.peak, self._process.memory_info().rss)
+        if self._hwm:
+            self.peak = max(self.peak, _read_hwm() or 0)
+
+        return self.start_rss, self.peak
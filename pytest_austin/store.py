@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+from austin.stats import Frame, InvalidSample, Metrics, Sample
+
+
+@dataclass
+class StoredSample:
+    """A distinct frame stack with its aggregated metrics."""
+
+    sample: Sample
+    count: int = 0
+
+
+def _split(line: str) -> Tuple[str, Metrics]:
+    """Split a sample line into its frame stack head and its metrics."""
+    parts = line.rsplit(maxsplit=3)
+    if len(parts) < 2:
+        raise InvalidSample(f"Sample has no metric values: {line}")
+
+    head, *metrics = parts
+
+    try:
+        if len(metrics) == 3:
+            return head, Metrics(*(int(metric) for metric in metrics))
+    except ValueError:
+        pass
+
+    try:
+        head, metric = line.rsplit(maxsplit=1)
+        return head, Metrics(int(metric))
+    except ValueError as e:
+        raise InvalidSample(f"Sample has invalid metric values: {line}") from e
+
+
+class SampleStore:
+    """Deduplicated store of Austin samples.
+
+    Samples that share the same process, thread and frame stack are parsed
+    only once and their metrics are aggregated, together with a hit count.
+    Frames are interned in a frame table that is shared by all the stacks, and
+    that can be shared with other stores too, so that the memory usage scales
+    with the number of distinct stacks rather than with the number of samples.
+    """
+
+    def __init__(self, frames: Optional[Dict[Frame, Frame]] = None) -> None:
+        self.frames: Dict[Frame, Frame] = {} if frames is None else frames
+        self.stacks: Dict[str, Optional[StoredSample]] = {}
+        self.invalid = 0
+
+    def add(self, line: str) -> None:
+        """Add a sample line to the store."""
+        try:
+            head, metrics = _split(line)
+        except InvalidSample:
+            self.invalid += 1
+            return
+
+        try:
+            stored = self.stacks[head]
+        except KeyError:
+            stored = self.stacks[head] = self._parse(head)
+
+        if stored is None:
+            self.invalid += 1
+            return
+
+        stored.sample.metrics += metrics
+        stored.count += 1
+
+    def _parse(self, head: str) -> Optional[StoredSample]:
+        try:
+            sample = Sample.parse(f"{head} 0")
+        except InvalidSample:
+            return None
+
+        frames = self.frames
+        sample.frames = [frames.setdefault(frame, frame) for frame in sample.frames]
+
+        return StoredSample(sample)
+
+    def __iter__(self) -> Iterator[Sample]:
+        """Iterate over the distinct samples with their aggregated metrics."""
+        for stored in self.stacks.values():
+            if stored is not None:
+                yield stored.sample
+
+    def __len__(self) -> int:
+        """The number of distinct valid samples in the store."""
+        return sum(1 for _ in self)
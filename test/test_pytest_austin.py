@@ -1,8 +1,28 @@
 from datetime import timedelta as td
+import gzip
+import json
 import os
 import os.path
+import re
+import sqlite3
+from time import perf_counter
+from types import SimpleNamespace
 
-from pytest_austin import _parse_time
+from austin.format.pprof import Mode, PProf
+from austin.stats import AustinStats, Metrics, Sample
+import pytest
+from pytest_austin import _parse_time, _thread_id, diff, PyTestAustin, rss
+from pytest_austin.history import History
+from pytest_austin.index import FrameIndex
+from pytest_austin.markers import (
+    _self_metrics,
+    Bytes,
+    CheckOutcome,
+    Microseconds,
+    no_regression,
+)
+from pytest_austin.rss import PeakRSS
+from pytest_austin.store import SampleStore
 
 
 def check_austin_dump(dir, needle):
@@ -17,10 +37,456 @@ def check_austin_dump(dir, needle):
         assert needle in fin.read()
 
 
+def frame_index(lines):
+    """Index the frames of the main thread from the given samples."""
+    stats = AustinStats()
+    for line in lines:
+        stats.update(Sample.parse(line))
+    return FrameIndex(list(stats.processes[1].threads["2"].children.values()))
+
+
 def test_parse_time():
     assert _parse_time(td(microseconds=10), 0) == 10
 
 
+def test_sample_store():
+    store = SampleStore()
+    for line in [
+        "P1;T2;main (main.py:1);foo (foo.py:2) 100",
+        "P1;T2;main (main.py:1);foo (foo.py:2) 150",
+        "P1;T2;main (main.py:1) 50",
+        "invalid",
+        "",
+        "   ",
+    ]:
+        store.add(line)
+
+    assert len(store) == 2
+    assert store.invalid == 3
+    assert len(store.frames) == 2
+
+    foo, main = sorted(store, key=lambda sample: -len(sample.frames))
+    assert foo.metrics == Metrics(250)
+    assert main.metrics == Metrics(50)
+    assert foo.frames[0] is main.frames[0]
+
+
+def test_frame_index():
+    index = frame_index(
+        [
+            "P1;T2;test (test.py:1);fib (fib.py:2);fib (fib.py:3) 100",
+            "P1;T2;test (test.py:1);fib (fib.py:2) 50",
+            "P1;T2;test (test.py:4);fib (other/fib.py:2) 20",
+        ]
+    )
+
+    assert sum(fs.total.time for fs in index.find("fib", "fib.py")) == 170
+    assert sum(fs.total.time for fs in index.find("fib", "other/fib.py")) == 20
+    assert sum(fs.total.time for fs in index.find("fib", "fib.py", 3)) == 0
+    assert sum(fs.total.time for fs in index.find("test", "test.py", 4)) == 20
+    assert not index.find("foo", "test.py")
+
+    assert sum(fs.total.time for fs in index.find("fib", "fib.py", 3, True)) == 100
+    assert sum(fs.total.time for fs in index.find("fib", "fib.py", nested=True)) == 270
+
+
+def test_frame_index_patterns():
+    index = frame_index(
+        [
+            "P1;T2;test (test.py:1);encode (codecs/json.py:2);_escape (codecs/json.py:3) 100",
+            "P1;T2;test (test.py:1);decode (codecs/json.py:4) 50",
+            "P1;T2;test (test.py:1);encode (codecs/xml.py:2) 20",
+            "P1;T2;test (test.py:1);encode (other.py:2) 10",
+        ]
+    )
+
+    def total(function, module, line=0):
+        return sum(fs.total.time for fs in index.find(function, module, line))
+
+    assert total("*", "codecs/*") == 170
+    assert total("*code", "codecs/json.py") == 150
+    assert total("_escape", "codecs/*") == 100
+    assert total("encode", "*.py") == 130
+    assert total("encode", "codecs/*", 2) == 120
+    assert total(re.compile(r"(en|de)code"), re.compile(r"codecs/j")) == 150
+    assert total(re.compile("code"), "*") == 0
+    assert not index.find("foo*", "*")
+
+    outcome = CheckOutcome(
+        (re.compile("enc.*"), "codecs/*", 0), 90, 100, Microseconds, True
+    )
+    assert outcome.mark == ("enc.*", "codecs/*", 0)
+
+
+def test_frame_index_threads():
+    stats = AustinStats()
+    for line in [
+        "P1;T2;test (test.py:1);submit (pool.py:2) 10",
+        "P1;T3;_worker (pool.py:10);work (test.py:5) 100",
+        "P1;T3;_worker (pool.py:10);wait (pool.py:12) 200",
+        "P1;T4;_worker (pool.py:10);work (test.py:5) 50",
+    ]:
+        stats.update(Sample.parse(line))
+
+    threads = stats.processes[1].threads
+    index = FrameIndex(list(threads["2"].children.values()))
+    index.threads = FrameIndex(
+        [fs for thread in ("3", "4") for fs in threads[thread].children.values()]
+    )
+
+    def total(index):
+        return sum(fs.total.time for fs in index.roots)
+
+    assert index.with_threads(None) is index
+    assert total(index.with_threads(True)) == 360
+    assert total(index.with_threads("work")) == 160
+    assert total(index.with_threads("w*")) == 360
+    assert index.with_threads("work") is index.with_threads("work")
+    assert not index.with_threads(True).find("work", "other.py")
+
+
+def test_frame_index_hottest():
+    index = frame_index(
+        [
+            "P1;T2;test (test.py:1);fib (fib.py:2);fib (fib.py:3) 100",
+            "P1;T2;test (test.py:1);fib (fib.py:2) 50",
+            "P1;T2;test (test.py:4);sort (sort.py:2) 120",
+            "P1;T2;test (test.py:5);sort (sort.py:3) 10",
+        ]
+    )
+
+    self_times, total_times = index.hottest(2)
+    assert self_times == [(150, "fib", "fib.py"), (130, "sort", "sort.py")]
+    assert total_times == [(280, "test", "test.py"), (150, "fib", "fib.py")]
+
+    # The test function spent no time in its own code
+    assert len(index.hottest(10)[0]) == 2
+
+
+def test_diff(tmp_path):
+    before = [
+        "P1;T2;main (main.py:1);test_a (test.py:2);fib (fib.py:3) 100",
+        "P1;T2;main (main.py:1);test_a (test.py:2);sort (sort.py:3) 50",
+        "P1;T2;main (main.py:1);test_b (test.py:8) 30",
+        "P1;T2;main (main.py:1) 30",
+    ]
+    after = [
+        "P1;T2;main (main.py:5);test_a (test.py:2);fib (fib.py:4) 150",
+        "P1;T2;main (main.py:1);test_a (test.py:2);sort (sort.py:3) 20",
+        "P1;T2;main (main.py:1);test_b (test.py:8) 30",
+    ]
+    tests = [("test_a", "test.py"), ("test_b[1]", "test.py")]
+
+    pprof = PProf()
+    for line in before:
+        pprof.add_sample(Sample.parse(line))
+    with (tmp_path / "before.pprof").open("wb") as fout:
+        pprof.dump(fout)
+    with gzip.open(tmp_path / "before.aprof.gz", "wt") as fout:
+        fout.write("\n".join(before) + "\n\n")
+
+    stacks = diff.by_test(diff.load(str(tmp_path / "before.pprof")), tests)
+    assert stacks == diff.by_test(diff.load(str(tmp_path / "before.aprof.gz")), tests)
+    assert sorted(stacks) == [("test_a", "test.py"), ("test_b", "test.py")]
+    assert sum(stacks[("test_a", "test.py")].values()) == 150
+
+    assert diff.memory(str(tmp_path / "before.pprof")) is False
+    assert diff.memory(str(tmp_path / "before.aprof.gz")) is None
+    with (tmp_path / "memory.pprof").open("wb") as fout:
+        PProf(Mode.MEMORY).dump(fout)
+    assert diff.memory(str(tmp_path / "memory.pprof")) is True
+
+    speedscope = diff.diff(
+        "diff",
+        stacks,
+        diff.by_test(diff.sample_stacks(Sample.parse(_) for _ in after), tests),
+    ).asdict()
+    frames = speedscope["shared"]["frames"]
+    gained, lost = speedscope["profiles"]
+
+    assert gained["name"] == "Time gained by test.py::test_a"
+    assert gained["weights"] == [50]
+    assert [frames[_]["name"] for _ in gained["samples"][0]] == ["test_a", "fib"]
+    assert lost["name"] == "Time lost by test.py::test_a"
+    assert lost["weights"] == [30]
+    assert [frames[_]["name"] for _ in lost["samples"][0]] == ["test_a", "sort"]
+
+    assert diff.diff("diff", stacks, stacks) is None
+
+
+def test_plugin_threads():
+    store = SampleStore()
+    for line in [
+        "P1;T2;test_pool (test.py:1);submit (pool.py:2) 10",
+        "P1;T3;_bootstrap (threading.py:1);work (test.py:5) 100",
+        "P1;T4;_bootstrap (threading.py:1);run (/venv/austin/threads.py:2) 300",
+        "P1;T5;_bootstrap (threading.py:1);_poll (/src/pytest_austin/rss.py:4) 300",
+        "P1;T6;_bootstrap (threading.py:1);get (/src/austin/client.py:4) 40",
+    ]:
+        store.add(line)
+
+    pytest_austin = PyTestAustin()
+    pytest_austin.pid, pytest_austin.main_thread = 1, "2"
+    pytest_austin.plugin_threads.update({"4", "5"})
+    pytest_austin.test_started("test_pool", "test.py")
+    pytest_austin.test_finished()
+
+    # The id of a plugin thread that is no longer running can be reused
+    pytest_austin.plugin_threads.discard("5")
+    pytest_austin.test_started("test_other", "test.py")
+    pytest_austin.test_finished()
+
+    index = pytest_austin._index_store(store, "test_pool", "test.py")
+    assert sum(fs.total.time for fs in index.threads.roots) == 140
+    assert sum(fs.total.time for fs in index.with_threads(True).roots) == 150
+
+    index = pytest_austin._index_store(store, "test_other", "test.py")
+    assert sum(fs.total.time for fs in index.threads.roots) == 440
+
+    pytest_austin.start(attach=False)
+    worker = _thread_id(pytest_austin._worker.ident)
+    assert worker in pytest_austin.plugin_threads
+    pytest_austin._finish()
+    assert worker not in pytest_austin.plugin_threads
+
+
+def test_child_processes():
+    store = SampleStore()
+    for line in [
+        "P1;T2;test_spawn (test.py:1);start (process.py:2) 10",
+        "P1;T7;_worker (pool.py:10) 20",
+        "P3;T4;_main (spawn.py:3);work (test.py:5) 100",
+        "P5;T6;_bootstrap (process.py:4);test_spawn (test.py:1);work (test.py:5) 50",
+    ]:
+        store.add(line)
+
+    pytest_austin = PyTestAustin()
+    pytest_austin.pid = 1
+    index = pytest_austin._index_store(store, "test_spawn", "test.py")
+
+    # Neither spawned nor forked child processes count towards the test total
+    assert sum(fs.total.time for fs in index.roots) == 10
+    assert sum(fs.total.time for fs in index.find("work", "test.py")) == 150
+    assert sum(fs.total.time for fs in index.find("w*", "test.py")) == 150
+    assert sum(fs.total.time for fs in index.threads.roots) == 20
+    assert sum(fs.total.time for fs in index.children.roots) == 150
+    assert index.with_threads(True).find("work", "test.py") == index.find(
+        "work", "test.py"
+    )
+
+
+def test_wrapped_test():
+    store = SampleStore()
+    for line in [
+        "P1;T2;main (pytest.py:1);wrapper (deco.py:3);check (test.py:5) 100",
+        "P1;T2;main (pytest.py:1);wrapper (deco.py:3) 10",
+        "P1;T3;_bootstrap (threading.py:1);work (test.py:8) 20",
+    ]:
+        store.add(line)
+
+    pytest_austin = PyTestAustin()
+    pytest_austin.pid, pytest_austin.main_thread = 1, "2"
+
+    # The test frame is not found, so the main thread is used instead
+    index = pytest_austin._index_store(store, "test_wrapped", "test.py")
+
+    assert sum(fs.total.time for fs in index.roots) == 110
+    assert sum(fs.total.time for fs in index.find("check", "test.py")) == 100
+    assert sum(fs.total.time for fs in index.threads.roots) == 20
+
+    pytest_austin.pid = 3
+    assert pytest_austin._index_store(store, "test_wrapped", "test.py") is None
+
+
+@pytest.mark.parametrize(
+    "mode, interval", [(None, "100000"), ("-m", "1000"), ("-s", "1000")]
+)
+def test_retune(monkeypatch, mode, interval):
+    class FakeProcess:
+        def cpu_percent(self):
+            return 100.0
+
+    pytest_austin = PyTestAustin()
+    pytest_austin.auto, pytest_austin.mode = True, mode
+    monkeypatch.setattr(pytest_austin, "is_running", lambda: True)
+    monkeypatch.setattr(pytest_austin, "get_process", FakeProcess)
+    monkeypatch.setattr(pytest_austin, "attach", lambda: None)
+    monkeypatch.setattr(pytest_austin, "detach", lambda: None)
+
+    # Only 10 samples were received in the last 2 seconds, at a 100 μs interval
+    pytest_austin._tuned = (perf_counter() - 2, 0)
+    pytest_austin.nsamples = 10
+    pytest_austin.retune()
+
+    assert pytest_austin.interval == interval
+    assert pytest_austin.instrumentation.counters["retunes"] == 1
+
+
+def test_repeated_test_checks():
+    pytest_austin = PyTestAustin()
+    pytest_austin.pid = 1
+    pytest_austin.start(attach=False)
+    pytest_austin.register_test(
+        "test_a",
+        "test.py",
+        [
+            SimpleNamespace(
+                name="total_time", args=(td(microseconds=350),), kwargs={"rounds": 3}
+            ),
+            SimpleNamespace(name="total_time", args=(td(microseconds=350),), kwargs={}),
+        ],
+    )
+
+    for round in range(1, 4):
+        pytest_austin.test_started("test_a", "test.py", round)
+        pytest_austin.on_sample_received(f"P1;T2;test_a (test.py:1) {round * 100}")
+    pytest_austin.test_finished()
+
+    # Only the check that requested the rounds sees all of them, so that the
+    # other one is not checked against the sum of all the rounds.
+    assert pytest_austin.check_tests() == 0
+    assert [outcome.actual for _, _, outcome in pytest_austin.report] == [200, 300]
+
+
+def test_peak_memory_without_samples():
+    pytest_austin = PyTestAustin()
+    pytest_austin.register_test(
+        "test_a",
+        "test.py",
+        [
+            SimpleNamespace(name="peak_memory", args=("1 MB",), kwargs={}),
+            SimpleNamespace(name="total_memory", args=("1 MB",), kwargs={}),
+        ],
+    )
+    pytest_austin.peak_rss[("test_a", "test.py")] = (1 << 20, 4 << 20)
+
+    # Austin collected no samples, but the resident set size is still checked
+    assert pytest_austin.check_tests() == 1
+    ((_, _, outcome),) = pytest_austin.report
+    assert outcome.actual == 4 << 20
+
+
+@pytest.mark.parametrize("platform,xdist_worker", [("darwin", False), ("linux", True)])
+def test_check_in_thread_pool(monkeypatch, platform, xdist_worker):
+    def fork(*args):
+        raise AssertionError("forked checks")
+
+    monkeypatch.setattr("pytest_austin.sys.platform", platform)
+    monkeypatch.setattr("pytest_austin.get_context", fork)
+
+    pytest_austin = PyTestAustin()
+    pytest_austin.jobs = 2
+    pytest_austin.xdist_worker = xdist_worker
+    pytest_austin._check_test = lambda function, module: [function]
+
+    # Forking is unsafe, so the checks are performed by a pool of threads
+    tests = [("test_a", "test.py"), ("test_b", "test.py")]
+    assert pytest_austin._check_in_pool(tests) == [["test_a"], ["test_b"]]
+
+
+def test_per_test_dump_errors(tmp_path):
+    pytest_austin = PyTestAustin()
+    pytest_austin.outdir = str(tmp_path / "missing")
+    pytest_austin.start(attach=False)
+
+    for test in ("test_a", "test_b"):
+        pytest_austin.test_started(test, "test.py")
+        pytest_austin.on_sample_received(f"P1;T2;{test} (test.py:1) 100")
+        pytest_austin.test_finished(f"test.py::{test}")
+
+    pytest_austin._finish()
+
+    assert [nodeid for nodeid, _ in pytest_austin.dump_errors] == [
+        "test.py::test_a",
+        "test.py::test_b",
+    ]
+    assert pytest_austin.instrumentation.counters["test dump errors"] == 2
+    assert ("test_b", "test.py") in pytest_austin.stores
+
+
+def test_no_regression_zero_baseline():
+    index = frame_index(["P1;T2;test (test.py:1);foo (foo.py:2) 100"])
+
+    pytest_austin = PyTestAustin()
+    pytest_austin.baseline = {"test.py::test": {"test": {"test.py": [100, 0, 0]}}}
+    mark = (pytest_austin, "test", "test.py")
+
+    assert no_regression(mark, memory=True)(index, 100, 0, 0) is None
+    assert no_regression(mark)(index, 100, 0, 0)
+
+    assert "(of 0 B)" in str(CheckOutcome(("f", "m.py", 0), 0, 0, Bytes, True))
+
+
+def test_zero_delta_outcome():
+    outcome = CheckOutcome(("f", "m.py", 0), 1.0, 1.0, Microseconds, True)
+    assert "--" not in str(outcome)
+
+
+def test_self_metrics():
+    index = frame_index(
+        [
+            "P1;T2;test (test.py:1);fib (fib.py:2);fib (fib.py:3) 100",
+            "P1;T2;test (test.py:1);fib (fib.py:2) 50",
+            "P1;T2;test (test.py:1) 30",
+        ]
+    )
+
+    assert _self_metrics(index.find("test", "test.py")).time == 30
+    assert _self_metrics(index.find("fib", "fib.py", nested=True)).time == 150
+    assert _self_metrics(index.find("fib", "fib.py")).time == 50
+
+
+def test_history(tmp_path):
+    history = History(str(tmp_path / "history.db"))
+
+    outcome = CheckOutcome(("test_a", "test_mod.py", 0), 90, 100, Microseconds, True)
+    for total in [100, 110, 90, 100, 200, 210]:
+        history.record(
+            "2.0.0",
+            None,
+            "100",
+            [("test_a", "test_mod.py", outcome)],
+            [
+                (("test_a", "test_mod.py"), (total, 0, 0)),
+                (("test_b", "m.py"), (1, 0, 0)),
+            ],
+        )
+
+    ((function, module, trend),) = history.trends(
+        [("test_a", "test_mod.py")], None, 2, 0.1
+    )
+    assert (function, module) == ("test_a", "test_mod.py")
+    assert trend.actual == 205 and trend.expected == 100 and not trend
+
+    # Not enough history
+    assert not list(history.trends([("test_a", "test_mod.py")], None, 4, 0.1))
+
+    # Different profile mode
+    assert not list(history.trends([("test_a", "test_mod.py")], "-m", 2, 0.1))
+
+    history.close()
+
+
+@pytest.mark.parametrize("hwm", [True, False])
+def test_peak_rss(monkeypatch, hwm):
+    if not hwm:
+        monkeypatch.setattr(rss, "_reset_hwm", lambda: False)
+
+    tracker = PeakRSS()
+    tracker.start()
+
+    # The poller only runs if the kernel cannot track the high-water mark
+    assert (tracker._thread is None) == tracker._hwm
+
+    data = bytearray(64 << 20)
+    data[:: 1 << 12] = b"\1" * len(data[:: 1 << 12])
+    del data
+
+    # The kernel RSS counters are approximate, by a few pages per CPU
+    start, peak = tracker.stop()
+    assert peak - start >= 63 << 20
+
+
 def test_austin_time_checks(testdir):
     """Test Austin time checks."""
 
@@ -128,3 +594,658 @@ def test_austin_full_checks(testdir):
     assert result.ret > 0
 
     check_austin_dump(testdir.tmpdir, "test_full_checks")
+
+
+def test_austin_parametrized_checks(testdir):
+    """Test Austin checks on parametrized test items."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.parametrize("delay", [0.01, 0.1])
+        @pytest.mark.total_time("100%")
+        @pytest.mark.total_time(td(milliseconds=50))
+        def test_parametrized(delay):
+            sleep(delay)
+    """
+    )
+
+    result = testdir.runpytest("-vs")
+
+    assert result.ret > 0
+
+    # Only the failed checks are reported, and only the slower test fails
+    lines = result.stdout.lines
+    report = lines[next(i for i, _ in enumerate(lines) if "Austin report" in _) :]
+    failed = [_ for _ in report if "::test_parametrized[" in _]
+    assert len(failed) == 1
+    assert "::test_parametrized[0.1]" in failed[0]
+    result.stdout.fnmatch_lines(["*1 check failed*"])
+
+
+def test_austin_multiple_formats(testdir):
+    """Test Austin dumps in multiple formats."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from time import sleep
+
+        def test_multiple_formats():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest(
+        "-vs", "--profile-format", "austin", "--profile-format", "pprof"
+    )
+
+    assert result.ret == 0
+
+    austin_files = [
+        file for file in os.listdir(testdir.tmpdir) if file.startswith(".austin")
+    ]
+    assert sorted(os.path.splitext(file)[1] for file in austin_files) == [
+        ".aprof",
+        ".pprof",
+    ]
+
+
+def test_austin_spill(testdir):
+    """Test Austin checks with the samples spilled to disk."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.total_time(td(microseconds=1000))
+        def test_spill_fails():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-spill")
+
+    assert result.ret > 0
+
+    check_austin_dump(testdir.tmpdir, "test_spill_fails")
+
+
+def test_austin_xdist(testdir):
+    """Test Austin checks with pytest-xdist."""
+    pytest.importorskip("xdist")
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.total_time(td(microseconds=1000))
+        def test_xdist_fails():
+            sleep(.1)
+
+        @pytest.mark.total_time(td(milliseconds=500))
+        def test_xdist_succeeds():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "-n", "2", "--austin-report", "full")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*1 check failed*"])
+
+    check_austin_dump(testdir.tmpdir, "test_xdist_")
+
+
+def test_austin_jobs(testdir):
+    """Test Austin checks performed by parallel jobs."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.total_time(td(microseconds=1000))
+        def test_jobs_fails():
+            sleep(.1)
+
+        @pytest.mark.total_time(td(milliseconds=500))
+        def test_jobs_succeeds():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-jobs", "2")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*1 check failed*"])
+
+
+def test_austin_regression_checks(testdir):
+    """Test Austin regression checks against a baseline."""
+
+    test_source = """
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.no_regression("20%")
+        def test_no_regression():
+            sleep({delay})
+    """
+
+    # create a temporary pytest test file
+    testdir.makepyfile(test_source.format(delay=0.05))
+
+    result = testdir.runpytest("-vs", "--austin-save-baseline", "baseline.json")
+
+    assert result.ret == 0
+    assert os.path.isfile(os.path.join(testdir.tmpdir, "baseline.json"))
+
+    # make the test slower
+    testdir.makepyfile(test_source.format(delay=0.25))
+
+    result = testdir.runpytest(
+        "-vs", "--austin-compare", "baseline.json", "--austin-report", "full"
+    )
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*test_no_regression*+*"])
+
+
+def test_austin_rounds(testdir):
+    """Test Austin time checks on repeated tests."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        ROUNDS = []
+
+        @pytest.mark.total_time(td(milliseconds=10), rounds=5)
+        def test_rounds():
+            ROUNDS.append(None)
+            sleep(.02)
+
+        def test_rounds_count():
+            assert len(ROUNDS) == 5
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-report", "full")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*test_rounds *+* ± *"])
+    result.assert_outcomes(passed=2)
+
+
+def test_austin_overhead(testdir):
+    """Test the self-instrumentation of pytest-austin."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.total_time(td(milliseconds=500))
+        def test_overhead():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest(
+        "-vs", "--austin-overhead", "--austin-overhead-json", "overhead.json"
+    )
+
+    assert result.ret == 0
+
+    result.stdout.fnmatch_lines(["wait ready *: * ms", "ingestion rate *samples/s"])
+
+    overhead = json.loads((testdir.tmpdir / "overhead.json").read_text("utf-8"))
+    assert {"wait ready", "ingestion", "checks", "dump"} <= set(overhead["phases"])
+    assert overhead["counters"]["samples"] > 0
+
+
+def test_austin_auto_sampling_interval(testdir):
+    """Test the adaptive sampling interval."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.parametrize("n", range(3))
+        def test_auto_interval(n):
+            sleep(.6)
+
+        @pytest.mark.total_time(td(milliseconds=500))
+        def test_auto_interval_check():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--sampling-interval", "auto")
+
+    assert result.ret == 0
+
+    result.stdout.fnmatch_lines(["Adaptive sampling interval: * μs (* samples/s)"])
+
+
+def test_austin_marked_only(testdir):
+    """Test that only the marked tests are profiled if required."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        def test_unmarked():
+            sleep(.1)
+
+        @pytest.mark.total_time(td(microseconds=1000))
+        def test_marked_fails():
+            sleep(.1)
+
+        @pytest.mark.total_time(td(milliseconds=500))
+        def test_marked_succeeds():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-marked-only")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*1 check failed*"])
+
+    check_austin_dump(testdir.tmpdir, "test_marked_fails")
+    (austin_file,) = testdir.tmpdir.listdir(lambda f: f.basename.startswith(".austin"))
+    assert "test_unmarked" not in austin_file.read_text("utf-8")
+
+
+def test_austin_per_test(testdir):
+    """Test the per-test profile files."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.parametrize("delay", [.1, .2])
+        def test_per_test(delay):
+            sleep(delay)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-per-test", "profiles")
+
+    assert result.ret == 0
+
+    profiles = testdir.tmpdir / "profiles"
+    index = json.loads((profiles / "index.json").read_text("utf-8"))
+    assert set(index) == {
+        "test_austin_per_test.py::test_per_test[0.1]",
+        "test_austin_per_test.py::test_per_test[0.2]",
+    }
+    for (filename,) in index.values():
+        assert "test_per_test" in (profiles / filename).read_text("utf-8")
+
+
+def test_austin_compress(testdir):
+    """Test the compressed profile dumps."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from time import sleep
+
+        def test_compress():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest(
+        "-vs", "--profile-format", "speedscope", "--austin-compress", "gzip"
+    )
+
+    assert result.ret == 0
+
+    (austin_file,) = [
+        file for file in os.listdir(testdir.tmpdir) if file.startswith(".austin")
+    ]
+    assert austin_file.endswith(".json.gz")
+
+    with gzip.open(os.path.join(testdir.tmpdir, austin_file), "rt") as fin:
+        assert "test_compress" in fin.read()
+
+
+def test_austin_history(testdir):
+    """Test the performance history."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        @pytest.mark.total_time(td(milliseconds=500))
+        def test_history():
+            sleep(.1)
+    """
+    )
+
+    for _ in range(2):
+        result = testdir.runpytest(
+            "-vs", "--austin-history", "history.db", "--austin-trend", "1"
+        )
+        assert result.ret == 0
+
+    db = sqlite3.connect(str(testdir.tmpdir / "history.db"))
+    assert db.execute("SELECT COUNT(*) FROM runs").fetchone() == (2,)
+    assert db.execute("SELECT COUNT(*) FROM outcomes").fetchone() == (2,)
+    (function,) = db.execute("SELECT DISTINCT function FROM totals").fetchone()
+    assert function == "test_history"
+
+
+@pytest.mark.parametrize("mode", ["time", "cpu"])
+def test_austin_cpu_time_checks(testdir, mode):
+    """Test Austin CPU time checks, in both wall and CPU time sessions."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        def busy(n):
+            return sum(i * i for i in range(n))
+
+        @pytest.mark.cpu_time(td(milliseconds=50))
+        def test_cpu_time_sleep():
+            sleep(.2)
+
+        @pytest.mark.cpu_time(td(microseconds=1000), function="busy")
+        def test_cpu_time_busy():
+            busy(1000000)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--profile-mode", mode)
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*test_cpu_time_busy busy*", "*1 check failed*"])
+
+
+def test_austin_peak_memory_checks(testdir):
+    """Test Austin peak memory checks."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        import pytest
+
+        def allocate(size):
+            data = bytearray(size)
+            data[:: 1 << 12] = b"\\1" * len(data[:: 1 << 12])
+            return len(data)
+
+        @pytest.mark.peak_memory("32 MB", growth=True)
+        def test_peak_memory_fails():
+            allocate(64 << 20)
+
+        @pytest.mark.peak_memory("99%")
+        def test_peak_memory_succeeds():
+            allocate(64 << 20)
+    """
+    )
+
+    result = testdir.runpytest("-vs")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*test_peak_memory_fails*", "*1 check failed*"])
+
+
+def test_austin_self_time_checks(testdir):
+    """Test Austin self time checks."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        def slow():
+            sleep(.2)
+
+        def dispatch():
+            slow()
+
+        @pytest.mark.self_time(td(milliseconds=50), function="dispatch")
+        @pytest.mark.self_time(td(milliseconds=50), function="slow")
+        @pytest.mark.total_time(td(milliseconds=50), function="dispatch")
+        def test_self_time():
+            dispatch()
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-report", "full")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*2 checks failed*"])
+
+
+def test_austin_pattern_checks(testdir):
+    """Test Austin checks with function and module patterns."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        import re
+        from time import sleep
+
+        import pytest
+
+        def encode():
+            sleep(.1)
+
+        def decode():
+            sleep(.1)
+
+        @pytest.mark.total_time(td(milliseconds=150), function="*code")
+        @pytest.mark.total_time(td(milliseconds=150), function=re.compile("de.*"))
+        def test_patterns():
+            encode()
+            decode()
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-report", "full")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*1 check failed*"])
+
+
+def test_austin_thread_checks(testdir):
+    """Test Austin checks on the work done by other threads."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        def work():
+            sleep(.2)
+
+        @pytest.mark.total_time(td(milliseconds=100), threads="work")
+        @pytest.mark.total_time(td(milliseconds=100), function="work", threads=True)
+        @pytest.mark.total_time("50%", function="work")
+        def test_threads():
+            with ThreadPoolExecutor(2) as pool:
+                pool.submit(work).result()
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-report", "full")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*2 checks failed*"])
+
+
+def test_austin_child_process_checks(testdir):
+    """Test Austin checks on the work done by child processes."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from multiprocessing import get_context
+        from time import sleep
+
+        import pytest
+
+        def work():
+            sleep(.5)
+
+        @pytest.mark.total_time(td(milliseconds=100), function="work")
+        def test_spawn():
+            process = get_context("spawn").Process(target=work)
+            process.start()
+            process.join()
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--minime", "--austin-report", "full")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(["*1 check failed*"])
+
+
+def test_austin_top(testdir):
+    """Test Austin report of the hottest functions."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from datetime import timedelta as td
+        from time import sleep
+
+        import pytest
+
+        def hot():
+            sleep(.2)
+
+        @pytest.mark.total_time(td(milliseconds=50))
+        def test_hot():
+            hot()
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-top", "3")
+
+    assert result.ret > 0
+
+    result.stdout.fnmatch_lines(
+        ["*::test_hot hottest functions", "*self*hot*", "*total*test_hot*"]
+    )
+
+
+def test_austin_diff(testdir):
+    """Test Austin differential profile against a previous dump."""
+
+    # create a temporary pytest test file
+    testdir.makepyfile(
+        """
+        from time import sleep
+
+        def test_diff():
+            sleep(.1)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--profile-format", "pprof")
+
+    assert result.ret == 0
+
+    (dump,) = [_ for _ in os.listdir(testdir.tmpdir) if _.endswith(".pprof")]
+
+    # make the test slower
+    testdir.makepyfile(
+        """
+        from time import sleep
+
+        def test_diff():
+            sleep(.2)
+    """
+    )
+
+    result = testdir.runpytest("-vs", "--austin-diff", dump)
+
+    assert result.ret == 0
+
+    result.stdout.fnmatch_lines(["Differential profile written on *.json"])
+
+    (difffile,) = [
+        _ for _ in os.listdir(testdir.tmpdir) if _.startswith(".austin_diff_")
+    ]
+    with open(os.path.join(testdir.tmpdir, difffile)) as fin:
+        profiles = [_["name"] for _ in json.load(fin)["profiles"]]
+    assert "Time gained by test_austin_diff.py::test_diff" in profiles
+
+    # a dump collected in a different mode cannot be compared
+    result = testdir.runpytest("-vs", "--austin-diff", dump, "--profile-mode", "memory")
+
+    assert result.ret > 0
+
+    result.stderr.fnmatch_lines(["*collected in a different profile mode*"])